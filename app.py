@@ -1,9 +1,9 @@
 # app.py
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context
 from google import genai
 from google.genai import types
 from google.api_core import retry
-import pandas as pd
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 import os
@@ -13,9 +13,34 @@ import glob
 from werkzeug.utils import secure_filename
 import tempfile
 import shutil
+import hashlib
+from urllib.parse import urlparse
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:  # Windows: one Chroma directory, so run a single worker
+    fcntl = None
+
+from caches import AnswerCache, TTLCache, normalize_query
+from embedding_cache import EmbeddingCache, embedding_key
+from lexical_index import reciprocal_rank_fusion
+from context_builder import build_context, estimate_tokens
+from shared_index import SharedIndexStore, rows_fingerprint
+from registry import UniversityRegistry, source_version
+from singleflight import SingleFlight, StreamFlight
+from scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, BusyError, Scheduler
+from ingestion import build_rows, row_hash, get_university_name, read_university_csv, validate_csv_structure
+import metrics
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
+# CSV uploads may be larger; they are spooled to disk and parsed in chunks
+MAX_UPLOAD_LENGTH = int(os.environ.get('MAX_UPLOAD_LENGTH', 512 * 1024 * 1024))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,64 +49,292 @@ logger = logging.getLogger(__name__)
 # Define a helper to retry when per-minute quota is reached.
 is_retriable = lambda e: (isinstance(e, genai.errors.APIError) and e.code in {429, 503})
 
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# The embedding API accepts at most this many documents per request
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 100))
+# Upper bound on embedding requests in flight at once across the process
+EMBED_MAX_CONCURRENCY = int(os.environ.get('EMBED_MAX_CONCURRENCY', 4))
+GENAI_CLIENT_POOL_SIZE = int(os.environ.get('GENAI_CLIENT_POOL_SIZE', 64))
+
+# Per-API-key Gemini quotas (0 disables a limit) and the most calls each key runs at once.
+# Interactive calls queue ahead of bulk indexing and answer "busy" after their timeout.
+GENERATE_RPM = int(os.environ.get('GENERATE_RPM', 2000))
+GENERATE_TPM = int(os.environ.get('GENERATE_TPM', 4000000))
+EMBED_RPM = int(os.environ.get('EMBED_RPM', 1500))
+EMBED_TPM = int(os.environ.get('EMBED_TPM', 0))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 8))
+INTERACTIVE_QUEUE_TIMEOUT = float(os.environ.get('INTERACTIVE_QUEUE_TIMEOUT', 10))
+BULK_QUEUE_TIMEOUT = float(os.environ.get('BULK_QUEUE_TIMEOUT', 300))
+
+# Batch answering: most questions per request and how many are worked on at once
+BATCH_MAX_QUESTIONS = int(os.environ.get('BATCH_MAX_QUESTIONS', 10000))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', GEMINI_MAX_CONCURRENCY))
+
+# On-disk locations for the vector store and the content-hashed embedding cache
+CHROMA_PERSIST_DIR = os.environ.get('CHROMA_PERSIST_DIR', os.path.join(os.path.dirname(__file__), 'chroma_db'))
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(CHROMA_PERSIST_DIR, 'embedding_cache.sqlite3'))
+
+try:
+    embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+except Exception as e:
+    logger.warning(f"Embedding cache unavailable, every document will be embedded: {e}")
+    embedding_cache = None
+
+# One genai.Client per API key so HTTP connections are reused between calls
+genai_clients = OrderedDict()
+genai_clients_lock = threading.Lock()
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_MAX_CONCURRENCY, thread_name_prefix='embed')
+
+gemini_scheduler = Scheduler(
+    {'generate': (GENERATE_RPM, GENERATE_TPM), 'embed': (EMBED_RPM, EMBED_TPM)},
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    max_keys=GENAI_CLIENT_POOL_SIZE
+)
+
+def get_genai_client(api_key):
+    """Get a pooled genai client for an API key"""
+    with genai_clients_lock:
+        client = genai_clients.get(api_key)
+        if client is None:
+            client = genai.Client(api_key=api_key)
+            genai_clients[api_key] = client
+            # Drop the least recently used client once the pool is full
+            if len(genai_clients) > GENAI_CLIENT_POOL_SIZE:
+                genai_clients.popitem(last=False)
+        else:
+            genai_clients.move_to_end(api_key)
+        return client
+
 class GeminiEmbeddingFunction(chromadb.EmbeddingFunction): # Inherit from chromadb.EmbeddingFunction directly
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, bulk=False):
         self.document_mode = True
         self.api_key = api_key
+        # Batch jobs embed questions at bulk priority too, behind interactive requests
+        self.bulk = bulk
+        # Documents sent to the API vs served from the embedding cache, for job reports
+        self.embedded_count = 0
+        self.reused_count = 0
 
-    @retry.Retry(predicate=is_retriable)
     def __call__(self, input: chromadb.Documents) -> chromadb.Embeddings:
+        embedding_task = "retrieval_document" if self.document_mode else "retrieval_query"
+
+        # Only document embeddings are cached on disk; they make up the corpus
+        # and are what every restart or new worker would otherwise recompute.
+        if not self.document_mode or embedding_cache is None:
+            self.embedded_count += len(input)
+            return self._embed(list(input), embedding_task)
+
+        keys = [embedding_key(EMBEDDING_MODEL, embedding_task, text) for text in input]
+        cached = embedding_cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        metrics.CACHE_REQUESTS.inc(len(keys) - len(missing), cache='document_embedding', result='hit')
+        metrics.CACHE_REQUESTS.inc(len(missing), cache='document_embedding', result='miss')
+        self.embedded_count += len(missing)
+        self.reused_count += len(keys) - len(missing)
+
+        if missing:
+            logger.info(f"Embedding {len(missing)} of {len(keys)} documents (cache hits: {len(keys) - len(missing)})")
+            vectors = self._embed([input[i] for i in missing], embedding_task, keys=[keys[i] for i in missing])
+            cached.update(zip((keys[i] for i in missing), vectors))
+
+        return [cached[key] for key in keys]
+
+    def _embed(self, texts, embedding_task, keys=None):
+        """Embed texts in batch-sized chunks, dispatching the chunks concurrently.
+
+        When cache keys are given, each chunk is written to the embedding cache
+        as soon as it succeeds so a failure elsewhere doesn't waste its work.
+        """
         if not self.api_key:
             raise ValueError("API key is required for embeddings")
-            
+
+        chunks = [(start, texts[start:start + EMBED_BATCH_SIZE]) for start in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if len(chunks) <= 1:
+            vectors = self._embed_chunk(texts, embedding_task) if texts else []
+            if keys and embedding_cache is not None:
+                embedding_cache.put_many(zip(keys, vectors))
+            return vectors
+
+        futures = {embed_executor.submit(self._embed_chunk, chunk, embedding_task): start for start, chunk in chunks}
+        results = [None] * len(texts)
+        errors = []
+        for future, start in futures.items():
+            try:
+                vectors = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            results[start:start + len(vectors)] = vectors
+            if keys and embedding_cache is not None:
+                embedding_cache.put_many(zip(keys[start:start + len(vectors)], vectors))
+
+        if errors:
+            logger.error(f"{len(errors)} of {len(chunks)} embedding chunks failed")
+            raise errors[0]
+        return results
+
+    def _embed_chunk(self, texts, embedding_task):
+        if self.document_mode or self.bulk:
+            return self._embed_bulk_chunk(texts, embedding_task)
+        # Questions fail fast instead of sleeping through retries; retrieval falls back to lexical
+        return self._call_embed(texts, embedding_task, PRIORITY_INTERACTIVE, INTERACTIVE_QUEUE_TIMEOUT)
+
+    # Each chunk retries on its own so a throttled chunk doesn't resend the others
+    @retry.Retry(predicate=is_retriable)
+    def _embed_bulk_chunk(self, texts, embedding_task):
+        return self._call_embed(texts, embedding_task, PRIORITY_BULK, BULK_QUEUE_TIMEOUT)
+
+    def _call_embed(self, texts, embedding_task, priority, timeout):
         try:
-            client = genai.Client(api_key=self.api_key)
-            
-            if self.document_mode:
-                embedding_task = "retrieval_document"
-            else:
-                embedding_task = "retrieval_query"
-
-            response = client.models.embed_content(
-                model="models/text-embedding-004",
-                contents=input,
-                config=types.EmbedContentConfig(
-                    task_type=embedding_task,
-                ),
-            )
+            client = get_genai_client(self.api_key)
+
+            # A batch of texts is one embed_content request against EMBED_RPM
+            with gemini_scheduler.slot(self.api_key, 'embed', priority,
+                                       tokens=sum(estimate_tokens(text) for text in texts), timeout=timeout):
+                response = client.models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=texts,
+                    config=types.EmbedContentConfig(
+                        task_type=embedding_task,
+                    ),
+                )
             return [e.values for e in response.embeddings]
         except Exception as e:
             logger.error(f"Embedding error: {e}")
             raise
 
-# Initialize ChromaDB with disabled telemetry and anonymous usage stats
+# Chroma's persistent client is not safe for several processes writing one directory,
+# so each worker claims its own slot under CHROMA_PERSIST_DIR, holding a lock on it for
+# its lifetime. Slots are reused across restarts, and the shared embedding cache means
+# a worker filling a fresh slot doesn't call the API again for rows already embedded.
+chroma_slot_locks = []
+
+def claim_chroma_directory(root):
+    """Return a Chroma directory under root that no other live process is using"""
+    os.makedirs(root, exist_ok=True)
+    if fcntl is None:
+        return root
+    slot = 0
+    while True:
+        path = os.path.join(root, f"worker-{slot}")
+        lock_file = open(f"{path}.lock", 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            slot += 1
+            continue
+        chroma_slot_locks.append(lock_file)
+        return path
+
+# Initialize a persistent ChromaDB with disabled telemetry and anonymous usage stats
+# so vectors survive restarts, deploys and new workers
 try:
-    chroma_client = chromadb.Client(Settings(
-        anonymized_telemetry=False,
-        allow_reset=True
-    ))
+    chroma_settings = {'anonymized_telemetry': False, 'allow_reset': True}
+    # Bound the HNSW segments Chroma keeps in memory, unloading least recently used collections
+    if os.environ.get('CHROMA_MEMORY_LIMIT_MB'):
+        chroma_settings.update(
+            chroma_segment_cache_policy='LRU',
+            chroma_memory_limit_bytes=int(float(os.environ['CHROMA_MEMORY_LIMIT_MB']) * 1024 * 1024)
+        )
+    chroma_directory = claim_chroma_directory(CHROMA_PERSIST_DIR)
+    chroma_client = chromadb.PersistentClient(path=chroma_directory, settings=Settings(**chroma_settings))
+    logger.info(f"Using ChromaDB directory {chroma_directory}")
 except Exception as e:
-    # Fallback to basic client if settings don't work
-    logger.warning(f"ChromaDB settings failed, using basic client: {e}")
+    # Fallback to an in-memory client if the persistent store can't be opened
+    logger.warning(f"Persistent ChromaDB at {CHROMA_PERSIST_DIR} unavailable, using in-memory client: {e}")
     chroma_client = chromadb.Client()
 
-# Global dictionaries to track loaded universities and their data
-loaded_universities = {}
-university_data = {}
+# Vector store backend: "chroma" keeps a store per process; "shared" builds each
+# university's index once as memory-mapped files that every worker maps read-only
+VECTOR_BACKEND_CHROMA = 'chroma'
+VECTOR_BACKEND_SHARED = 'shared'
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', VECTOR_BACKEND_CHROMA).lower()
+SHARED_INDEX_DIR = os.environ.get('SHARED_INDEX_DIR', os.path.join(CHROMA_PERSIST_DIR, 'shared_index'))
+shared_indexes = SharedIndexStore(SHARED_INDEX_DIR) if VECTOR_BACKEND == VECTOR_BACKEND_SHARED else None
+
+# In-process caches so repeated questions skip the embedding and generation calls.
+# SEMANTIC_CACHE_THRESHOLD (cosine similarity, e.g. 0.95) also serves near-duplicate questions.
+query_embedding_cache = TTLCache(
+    maxsize=int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', 24 * 3600))
+)
+answer_cache = AnswerCache(
+    maxsize=int(os.environ.get('ANSWER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600)),
+    similarity_threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD') or 0) or None
+)
+
+# Concurrent identical work (collection builds, query embeddings, answers) runs once and is shared
+collection_flight = SingleFlight('collection')
+query_embedding_flight = SingleFlight('query_embedding')
+answer_flight = SingleFlight('answer')
+answer_stream_flight = StreamFlight('answer_stream')
+
+# Loaded universities, unloaded least recently queried first when over the memory budget
+# and reloaded from their CSV on demand. Uploads are kept in UPLOAD_DIR for that reason.
+UNIVERSITY_MEMORY_BUDGET_MB = float(os.environ.get('UNIVERSITY_MEMORY_BUDGET_MB', 1024))
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', os.path.join(os.path.dirname(__file__), 'uploads'))
+registry = UniversityRegistry(int(UNIVERSITY_MEMORY_BUDGET_MB * 1024 * 1024))
+
+# Retrieval modes: vector (Chroma), lexical (in-process BM25, no network) or
+# hybrid (both, fused with reciprocal-rank fusion). Requests may override the default.
+RETRIEVAL_VECTOR = 'vector'
+RETRIEVAL_LEXICAL = 'lexical'
+RETRIEVAL_HYBRID = 'hybrid'
+RETRIEVAL_MODES = (RETRIEVAL_VECTOR, RETRIEVAL_LEXICAL, RETRIEVAL_HYBRID)
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', RETRIEVAL_VECTOR).lower()
+
+# Context assembly: how many candidates to retrieve and how to trim them into the prompt
+CONTEXT_CANDIDATES = int(os.environ.get('CONTEXT_CANDIDATES', 30))
+CONTEXT_MAX_PASSAGES = int(os.environ.get('CONTEXT_MAX_PASSAGES', 15))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))
+CONTEXT_SCORE_MARGIN = float(os.environ.get('CONTEXT_SCORE_MARGIN', 0.5))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', 0.9))
+CONTEXT_MMR_LAMBDA = float(os.environ.get('CONTEXT_MMR_LAMBDA', 0.7))
+
+# Federated search: one query embedding fanned out over several universities in parallel
+FEDERATED_MAX_UNIVERSITIES = int(os.environ.get('FEDERATED_MAX_UNIVERSITIES', 10))
+SEARCH_MAX_CONCURRENCY = int(os.environ.get('SEARCH_MAX_CONCURRENCY', 8))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 50))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_MAX_CONCURRENCY, thread_name_prefix='search')
+
+# Background indexing: collections are built eagerly after preload/upload so
+# the first /ask for a university doesn't have to embed the whole corpus.
+# Without a server-side key, indexing waits for the first user-supplied key.
+INDEX_API_KEY = os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY')
+INDEX_WORKERS = int(os.environ.get('INDEX_WORKERS', 2))
 
-# Expected CSV column names for validation
-EXPECTED_COLUMNS = ['rec_id','uni_id', 'uni_name', 'dept_id', 'dept_name','description','rec_url','date_created','date_modified', 'user_rating', 'tags', 'rec_content']
+INDEX_PENDING = 'pending'
+INDEX_INDEXING = 'indexing'
+INDEX_READY = 'ready'
+INDEX_FAILED = 'failed'
+
+index_status = {}
+index_status_lock = threading.Lock()
+index_executor = ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix='indexer')
+
+# Background jobs (e.g. in-place re-uploads), reported by /api/jobs/<job_id>
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_SUPERSEDED = 'superseded'
+MAX_TRACKED_JOBS = 1000
+
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
 
 def preload_csv_files():
-    """Preload all CSV files from the data directory at startup"""
+    """Preload all CSV files from the data directory and earlier uploads at startup"""
     data_dir = os.path.join(os.path.dirname(__file__), 'data')
     
     if not os.path.exists(data_dir):
         logger.warning(f"Data directory not found: {data_dir}")
-        return
     
-    # Find all CSV files in the data directory
-    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
+    # Uploads kept from earlier runs come first, so a replaced shipped university keeps its new data
+    csv_files = sorted(glob.glob(os.path.join(UPLOAD_DIR, '*.csv'))) + sorted(glob.glob(os.path.join(data_dir, '*.csv')))
     
     for csv_file in csv_files:
         # Skip Zone.Identifier files and other non-data files
@@ -91,19 +344,8 @@ def preload_csv_files():
         try:
             logger.info(f"Loading CSV file: {csv_file}")
             
-            # Try multiple encodings to handle different file formats
-            df = None
-            for encoding in ['utf-8', 'windows-1252', 'cp1252', 'iso-8859-1', 'latin-1']:
-                try:
-                    df = pd.read_csv(csv_file, names=EXPECTED_COLUMNS, encoding=encoding)
-                    logger.info(f"Successfully read {csv_file} with {encoding} encoding")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if df is None:
-                logger.error(f"Could not read {csv_file} with any supported encoding")
-                continue
+            df, encoding = read_university_csv(csv_file)
+            logger.info(f"Successfully read {csv_file} with {encoding} encoding")
             
             # Validate CSV structure
             is_valid, message = validate_csv_structure(df)
@@ -112,19 +354,15 @@ def preload_csv_files():
                 continue
             
             # Extract university name from the uni_name column
-            university_name = df['uni_name'].iloc[1] if not df.empty else "Unknown University"
-            university_name = str(university_name).strip()
+            university_name = get_university_name(df)
             
             # Check if university already exists
-            if university_name in university_data:
+            if university_name in registry:
                 logger.info(f"University '{university_name}' already loaded, skipping duplicate")
                 continue
             
             # Store university data
-            university_data[university_name] = {
-                'name': university_name,
-                'data': df
-            }
+            registry.add(university_name, df, csv_file)
             
             logger.info(f"Successfully preloaded university: {university_name} with {len(df)} records")
             
@@ -132,30 +370,29 @@ def preload_csv_files():
             logger.error(f"Error loading CSV file {csv_file}: {e}")
             continue
     
-    logger.info(f"Preloaded {len(university_data)} universities from data directory")
+    logger.info(f"Preloaded {len(registry)} universities")
 
-def validate_csv_structure(df):
-    """Validate that uploaded CSV has the correct structure"""
-    if df.empty:
-        return False, "CSV file is empty"
-    
-    # Check if all expected columns are present
-    missing_columns = set(EXPECTED_COLUMNS) - set(df.columns)
-    if missing_columns:
-        return False, f"Missing required columns: {', '.join(missing_columns)}"
-    
-    # Check if required fields have data
-    if df['uni_name'].isna().all():
-        return False, "University name column is empty"
-    
-    if df['rec_content'].isna().all():
-        return False, "Content column is empty"
-    
-    return True, "Valid CSV structure"
+def get_collection_name(university_name):
+    """Get the ChromaDB collection name for a university"""
+    return f"uni_{secure_filename(university_name).replace(' ', '_').lower()}"
 
-def get_or_create_collection(api_key, university_name):
+def build_collection_rows(university_name):
+    """Build the rows indexed for a university, returning (registry entry, documents, metadatas, ids)"""
+    entry, data, _ = registry.snapshot(university_name)
+    if entry is None:
+        raise ValueError(f"No data loaded for {university_name}")
+    return (entry, *build_rows(data, university_name))
+
+def get_or_create_collection(api_key, university_name, job_id=None):
     """Get or create ChromaDB collection for specific university"""
-    collection_name = f"uni_{secure_filename(university_name).replace(' ', '_').lower()}"
+    # Simultaneous first requests share one build instead of each embedding the corpus
+    return collection_flight.do(university_name, _get_or_create_collection, api_key, university_name, job_id)
+
+def _get_or_create_collection(api_key, university_name, job_id=None):
+    if VECTOR_BACKEND == VECTOR_BACKEND_SHARED:
+        return get_or_create_shared_index(api_key, university_name, job_id)
+
+    collection_name = get_collection_name(university_name)
     
     try:
         embed_fn = GeminiEmbeddingFunction(api_key=api_key)
@@ -172,51 +409,228 @@ def get_or_create_collection(api_key, university_name):
             logger.info(f"Creating new ChromaDB collection for {university_name}")
             db = chroma_client.create_collection(name=collection_name, embedding_function=embed_fn)
         
-        # Add documents if collection is empty and we have data for this university
-        if university_name in university_data and db.count() == 0:
-            uni_data = university_data[university_name]
-            student_department_id = '0'  # Default department
-            df = uni_data['data']
-            
-            # Filter data for the department
-            dept_data = df.loc[df['dept_id'] == student_department_id]
-            
-            # Combine content and URL for storage and retrieval
-            documents = []
-            metadatas = []
-            for _, row in dept_data.iterrows():
-                content = str(row['rec_content']) if pd.notna(row['rec_content']) else ""
-                url = str(row['rec_url']) if pd.notna(row['rec_url']) else ""
-                
-                # Store content for embedding but keep URL in metadata
-                documents.append(content)
-                metadatas.append({
-                    'rec_url': url,
-                    'rec_id': str(row['rec_id']) if pd.notna(row['rec_id']) else "",
-                    'description': str(row['description']) if pd.notna(row['description']) else ""
-                })
-            
-            if documents:
-                logger.info(f"Adding {len(documents)} documents to ChromaDB for {university_name}")
-                try:
-                    db.add(
-                        documents=documents, 
-                        metadatas=metadatas,
-                        ids=[f"{university_name}_{i}" for i in range(len(documents))]
-                    )
-                    loaded_universities[university_name] = True
-                    logger.info(f"Successfully added documents for {university_name}")
-                except Exception as e:
-                    logger.error(f"Error adding documents for {university_name}: {e}")
-        else:
-            logger.info(f"ChromaDB already contains documents for {university_name}")
+        # Bring the collection in line with the loaded rows once per process;
+        # a persisted collection that already matches is reused as is
+        if university_name in registry and not registry.is_collection_loaded(university_name):
+            # A failed sync propagates so the background job fails and indexing is retried;
+            # only the entry whose rows were fully synced is marked loaded
+            registry.mark_collection_loaded(sync_collection(db, university_name, embed_fn, job_id))
         
         return db
         
     except Exception as e:
         logger.error(f"ChromaDB collection error for {university_name}: {e}")
+        raise Exception(f"Database initialization failed for {university_name}. Please try again.") from e
+
+def sync_collection(db, university_name, embed_fn, job_id=None):
+    """Upsert changed rows and delete removed ones, so only edited content is re-embedded.
+
+    Returns the registry entry whose rows were synced. The rows fingerprint is
+    only recorded once every upsert and delete has succeeded.
+    """
+    entry, documents, metadatas, ids = build_collection_rows(university_name)
+    fingerprint = rows_fingerprint(documents, metadatas, ids)
+    if (db.metadata or {}).get('rows_fingerprint') == fingerprint:
+        update_job(job_id, unchanged=len(ids), reused=len(ids))
+        logger.info(f"ChromaDB already contains documents for {university_name}")
+        return entry
+
+    existing = db.get(include=['documents', 'metadatas'])
+    changed, removed, unchanged = diff_rows(zip(existing['ids'], existing['documents'], existing['metadatas']),
+                                            documents, metadatas, ids, university_name, job_id)
+
+    batch_size = chroma_client.get_max_batch_size()
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        db.upsert(
+            documents=[documents[i] for i in batch],
+            metadatas=[metadatas[i] for i in batch],
+            ids=[ids[i] for i in batch]
+        )
+        update_job(job_id, embedded=embed_fn.embedded_count, reused=unchanged + embed_fn.reused_count)
+    for start in range(0, len(removed), batch_size):
+        db.delete(ids=removed[start:start + batch_size])
+
+    db.modify(metadata={'rows_fingerprint': fingerprint})
+    logger.info(f"Successfully added documents for {university_name}")
+    return entry
+
+def diff_rows(existing_rows, documents, metadatas, ids, university_name, job_id=None):
+    """Compare new rows with indexed (id, document, metadata) rows, recording the counts on the job.
+
+    Returns (indices of added or changed rows, removed ids, unchanged count).
+    """
+    existing_hashes = {row_id: row_hash(document, metadata) for row_id, document, metadata in existing_rows}
+    changed = [i for i, row_id in enumerate(ids) if existing_hashes.get(row_id) != row_hash(documents[i], metadatas[i])]
+    removed = list(existing_hashes.keys() - set(ids))
+    added = sum(1 for i in changed if ids[i] not in existing_hashes)
+    unchanged = len(ids) - len(changed)
+    logger.info(f"Syncing {university_name}: {added} added, {len(changed) - added} updated, "
+                f"{len(removed)} removed, {unchanged} unchanged")
+    update_job(job_id, added=added, updated=len(changed) - added, deleted=len(removed), unchanged=unchanged)
+    return changed, removed, unchanged
+
+def get_or_create_shared_index(api_key, university_name, job_id=None):
+    """Get a university's shared index, building and publishing it once across workers"""
+    collection_name = get_collection_name(university_name)
+
+    try:
+        # The store follows the published pointer, so a rebuild by another worker is picked up here
+        index = shared_indexes.open(collection_name)
+        entry = registry.entry(university_name)
+        if index is not None and entry is not None and index.source_version > entry.source_version:
+            # Another worker published a newer upload than this worker has loaded; don't revert it
+            adopt_newer_upload(university_name, entry, index)
+            return index
+        if index is not None and (registry.is_collection_loaded(university_name) or entry is None):
+            return index
+        if entry is None:
+            raise ValueError(f"No data loaded for {university_name}")
+
+        entry, documents, metadatas, ids = build_collection_rows(university_name)
+
+        diff_rows((index.row(i) for i in range(index.count())) if index is not None else (),
+                  documents, metadatas, ids, university_name, job_id)
+        embed_fn = GeminiEmbeddingFunction(api_key=api_key)
+        embed_fn.document_mode = True
+        index = shared_indexes.build(collection_name, documents, metadatas, ids, embed_fn, entry.source_version)
+        # A rebuild re-embeds only rows missing from the embedding cache
+        update_job(job_id, embedded=embed_fn.embedded_count, reused=len(ids) - embed_fn.embedded_count)
+        registry.mark_collection_loaded(entry)
+        return index
+
+    except Exception as e:
+        logger.error(f"Shared index error for {university_name}: {e}")
         raise Exception(f"Database initialization failed for {university_name}. Please try again.")
 
+def adopt_newer_upload(university_name, entry, index):
+    """Catch this worker up with an upload another worker indexed: reload its rows and drop stale answers"""
+    upload_path = os.path.join(UPLOAD_DIR, f"{get_collection_name(university_name)}.csv")
+    if source_version(upload_path) < index.source_version:
+        # The newer file isn't on this box; answer from the shared index with the rows already loaded
+        registry.mark_collection_loaded(entry)
+        return
+    logger.info(f"Adopting shared index for {university_name} built from a newer upload; reloading its rows")
+    df, _ = read_university_csv(upload_path)
+    registry.mark_collection_loaded(registry.add(university_name, df, upload_path))
+    answer_cache.invalidate_university(university_name)
+
+def get_index_status(university_name):
+    """Get the indexing status for a university"""
+    with index_status_lock:
+        return index_status.get(university_name, {'status': INDEX_PENDING, 'error': None, 'job': None})
+
+def set_index_status(university_name, status, error=None, job_id=None):
+    """Record the indexing status for a university"""
+    with index_status_lock:
+        index_status[university_name] = {'status': status, 'error': error, 'job': job_id}
+
+def create_job(kind, university_name):
+    """Start tracking a background job, returning its id"""
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {
+            'id': job_id, 'kind': kind, 'university': university_name, 'status': JOB_QUEUED, 'error': None,
+            'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'embedded': 0, 'reused': 0,
+            'created_at': time.time(), 'finished_at': None, 'superseded_by': None
+        }
+        # Keep a bounded history of finished jobs
+        while len(jobs) > MAX_TRACKED_JOBS:
+            jobs.popitem(last=False)
+    return job_id
+
+def update_job(job_id, **fields):
+    """Update a tracked job's fields; a no-op for work not started by a job"""
+    if job_id is None:
+        return
+    with jobs_lock:
+        if job_id in jobs:
+            jobs[job_id].update(fields)
+
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+def supersede_job(job_id, newer_job_id):
+    """Close a queued refresh that a newer upload replaced; the newer job builds its rows too"""
+    if job_id is None or job_id == newer_job_id:
+        return
+    update_job(job_id, status=JOB_SUPERSEDED, superseded_by=newer_job_id, finished_at=time.time())
+
+def is_collection_current(university_name):
+    """Check whether the collection on disk was built from the rows loaded now, so answering needs no embedding"""
+    try:
+        entry, documents, metadatas, ids = build_collection_rows(university_name)
+        fingerprint = rows_fingerprint(documents, metadatas, ids)
+        if VECTOR_BACKEND == VECTOR_BACKEND_SHARED:
+            index = shared_indexes.open(get_collection_name(university_name))
+            # A newer index published by another worker is adopted without embedding
+            return index is not None and index.count() > 0 and (
+                index.fingerprint == fingerprint or index.source_version > entry.source_version)
+        db = chroma_client.get_collection(name=get_collection_name(university_name))
+        return db.count() > 0 and (db.metadata or {}).get('rows_fingerprint') == fingerprint
+    except Exception:
+        return False
+
+def schedule_indexing(university_name, api_key=None, job_id=None, refresh=False):
+    """Queue a background build or refresh of a university's collection if it isn't ready or in progress"""
+    api_key = api_key or INDEX_API_KEY
+    with index_status_lock:
+        current = index_status.get(university_name, {})
+        if current.get('status') == INDEX_INDEXING:
+            if refresh:
+                # The build in progress may have read the old rows; run again when it finishes
+                supersede_job(current.get('queued_job'), job_id)
+                current['queued_job'] = job_id
+            return INDEX_INDEXING
+        if current.get('status') == INDEX_READY and not refresh:
+            return INDEX_READY
+        # A refresh still waiting for a key is picked up by the next caller that has one
+        if job_id is not None:
+            supersede_job(current.get('job'), job_id)
+        job_id = job_id or current.get('job')
+        if api_key:
+            index_status[university_name] = {'status': INDEX_INDEXING, 'error': None, 'job': job_id}
+
+    if not api_key:
+        # Without a key we can only pick up a collection persisted by an earlier run from the
+        # same rows; otherwise lexical retrieval answers until someone with a key indexes it
+        stale = refresh or job_id is not None
+        status = INDEX_READY if not stale and is_collection_current(university_name) else INDEX_PENDING
+        set_index_status(university_name, status, job_id=job_id)
+        return status
+
+    index_executor.submit(index_university, university_name, api_key, job_id)
+    return INDEX_INDEXING
+
+def index_university(university_name, api_key, job_id=None):
+    """Build or refresh a university's collection and record whether it is ready to answer questions"""
+    update_job(job_id, status=JOB_RUNNING)
+    status, error = INDEX_READY, None
+    try:
+        with metrics.stage_timer('indexing'):
+            db = get_or_create_collection(api_key, university_name, job_id)
+        if db.count() > 0:
+            logger.info(f"Index ready for {university_name}")
+        else:
+            status, error = INDEX_FAILED, "No documents were indexed"
+    except Exception as e:
+        logger.error(f"Background indexing failed for {university_name}: {e}")
+        status, error = INDEX_FAILED, str(e)
+
+    with index_status_lock:
+        queued = index_status.get(university_name, {})
+        index_status[university_name] = {'status': status, 'error': error, 'job': None}
+    update_job(job_id, status=JOB_COMPLETED if status == INDEX_READY else JOB_FAILED, error=error, finished_at=time.time())
+    if 'queued_job' in queued:
+        schedule_indexing(university_name, api_key, job_id=queued['queued_job'], refresh=True)
+
+def start_background_indexing():
+    """Queue indexing for every loaded university"""
+    for university_name in registry.names():
+        schedule_indexing(university_name)
+
 # --- Flask Routes ---
 
 @app.route('/')
@@ -227,16 +641,25 @@ def index():
 def get_universities():
     """Get list of available universities"""
     universities = []
-    for name, data in university_data.items():
+    for name in registry.names():
+        entry = registry.entry(name)
+        if entry is None:
+            continue
+        status = get_index_status(name)
         universities.append({
             'name': name,
-            'document_count': len(data['data']) if 'data' in data else 0
+            'document_count': entry.document_count,
+            'status': status['status'],
+            'error': status['error'],
+            'job': status.get('job')
         })
     return jsonify({"universities": universities})
 
 @app.route('/api/universities/upload', methods=['POST'])
 def upload_university():
     """Upload a new university CSV file"""
+    # Raise the limit for this request only, before the form is parsed
+    request.max_content_length = MAX_UPLOAD_LENGTH
     if 'file' not in request.files:
         return jsonify({"error": "No file provided"}), 400
     
@@ -253,16 +676,10 @@ def upload_university():
             file.save(temp_file.name)
             
             # Read and validate CSV with encoding handling
-            df = None
-            for encoding in ['utf-8', 'windows-1252', 'cp1252', 'iso-8859-1', 'latin-1']:
-                try:
-                    df = pd.read_csv(temp_file.name, names=EXPECTED_COLUMNS, encoding=encoding)
-                    logger.info(f"Successfully read uploaded file with {encoding} encoding")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if df is None:
+            try:
+                df, encoding = read_university_csv(temp_file.name)
+                logger.info(f"Successfully read uploaded file with {encoding} encoding")
+            except ValueError:
                 os.unlink(temp_file.name)  # Clean up temp file
                 return jsonify({"error": "Could not read CSV file with any supported encoding. Please ensure your file is saved with UTF-8, Windows-1252, or Latin-1 encoding."}), 400
             
@@ -273,55 +690,74 @@ def upload_university():
                 return jsonify({"error": f"Invalid CSV structure: {message}"}), 400
             
             # Extract university name from the uni_name column
-            university_name = df['uni_name'].iloc[1] if not df.empty else "Unknown University"
-            university_name = str(university_name).strip()
+            university_name = get_university_name(df)
             
-            # Check if university already exists
-            if university_name in university_data:
-                os.unlink(temp_file.name)  # Clean up temp file
-                return jsonify({"error": f"University '{university_name}' already exists. Please delete the existing one first if you want to replace it."}), 400
+            # An existing university is replaced in place; only changed rows are re-embedded
+            replacing = university_name in registry
+            
+            # Keep the file so the university can be reloaded after eviction or a restart
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            upload_path = os.path.join(UPLOAD_DIR, f"{get_collection_name(university_name)}.csv")
+            shutil.move(temp_file.name, upload_path)
             
             # Store university data using the actual university name from CSV
-            university_data[university_name] = {
-                'name': university_name,
-                'data': df
-            }
+            registry.add(university_name, df, upload_path)
+            
+            # Answers cached for an earlier upload under this name are stale
+            answer_cache.invalidate_university(university_name)
             
-            # Clean up temp file
-            os.unlink(temp_file.name)
+            # Build or refresh the collection in the background
+            job_id = create_job('refresh' if replacing else 'upload', university_name)
+            status = schedule_indexing(university_name, request.form.get('api_key'), job_id=job_id, refresh=replacing)
             
-            logger.info(f"Successfully uploaded university: {university_name}")
+            logger.info(f"Successfully {'replaced' if replacing else 'uploaded'} university: {university_name}")
             return jsonify({
-                "message": f"University '{university_name}' uploaded successfully",
+                "message": f"University '{university_name}' {'updated' if replacing else 'uploaded'} successfully",
                 "university": {
                     "name": university_name,
-                    "document_count": len(df)
-                }
+                    "document_count": len(df),
+                    "status": status
+                },
+                "job": get_job(job_id)
             })
             
     except Exception as e:
         logger.error(f"Error uploading university: {e}")
         return jsonify({"error": f"Error processing file: {str(e)}"}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get the progress of a background job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job": job})
+
 @app.route('/api/universities/<university_name>', methods=['DELETE'])
 def delete_university(university_name):
     """Delete a university database"""
-    if university_name not in university_data:
+    if university_name not in registry:
         return jsonify({"error": "University not found"}), 404
     
     try:
         # Remove from ChromaDB
-        collection_name = f"uni_{secure_filename(university_name).replace(' ', '_').lower()}"
+        collection_name = get_collection_name(university_name)
         try:
             chroma_client.delete_collection(name=collection_name)
             logger.info(f"Deleted ChromaDB collection for {university_name}")
         except Exception as e:
             logger.warning(f"Could not delete ChromaDB collection for {university_name}: {e}")
+        if shared_indexes is not None:
+            shared_indexes.delete(collection_name)
         
         # Remove from memory
-        del university_data[university_name]
-        if university_name in loaded_universities:
-            del loaded_universities[university_name]
+        entry = registry.remove(university_name)
+        # Shipped data files stay; uploaded copies are removed with the university
+        if entry is not None and os.path.dirname(os.path.abspath(entry.source_path)) == os.path.abspath(UPLOAD_DIR):
+            os.remove(entry.source_path)
+        with index_status_lock:
+            index_status.pop(university_name, None)
+        answer_cache.invalidate_university(university_name)
         
         logger.info(f"Successfully deleted university: {university_name}")
         return jsonify({"message": f"University '{university_name}' deleted successfully"})
@@ -330,133 +766,878 @@ def delete_university(university_name):
         logger.error(f"Error deleting university {university_name}: {e}")
         return jsonify({"error": f"Error deleting university: {str(e)}"}), 500
 
-@app.route('/ask', methods=['POST'])
-def ask_chatbot():
-    user_query = request.json.get('query')
-    custom_prompt = request.json.get('custom_prompt')
-    api_key = request.json.get('api_key')
-    university_name = request.json.get('university_name')
-    
+GENERATION_MODEL = "gemini-2.0-flash"
+
+def validate_ask_request(payload):
+    """Validate an /ask payload, returning (error body, status code) or None"""
+    user_query = payload.get('query')
+    api_key = payload.get('api_key')
+    university_name = payload.get('university_name')
+
     if not user_query:
-        return jsonify({"answer": "Please provide a query."}), 400
+        return {"answer": "Please provide a query."}, 400
     
     if not api_key:
-        return jsonify({"answer": "Please provide your Google API key in the settings."}), 400
+        return {"answer": "Please provide your Google API key in the settings."}, 400
     
     if not university_name:
-        return jsonify({"answer": "Please select a university from the dropdown before asking questions."}), 400
+        return {"answer": "Please select a university from the dropdown before asking questions."}, 400
+
+    option_error = invalid_retrieval_mode(payload.get('retrieval_mode')) or invalid_custom_prompt(payload.get('custom_prompt'))
+    if option_error:
+        return {"answer": option_error}, 400
     
-    if university_name not in university_data:
-        return jsonify({"answer": "The selected university is no longer available. Please select a different university."}), 400
+    if university_name not in registry:
+        return {"answer": "The selected university is no longer available. Please select a different university."}, 400
 
-    try:
-        # Initialize client with user's API key
-        client = genai.Client(api_key=api_key)
-        
-        # Get or create collection for selected university
-        db = get_or_create_collection(api_key, university_name)
-        
-        # Create embedding function for query
-        embed_fn = GeminiEmbeddingFunction(api_key=api_key)
+    # Don't block on embedding the corpus; kick off indexing with the user's key and,
+    # unless lexical retrieval can answer meanwhile, ask the user to come back later
+    status = get_index_status(university_name)['status']
+    if status != INDEX_READY:
+        status = schedule_indexing(university_name, api_key)
+        if status != INDEX_READY and registry.get_lexical_index(university_name) is None:
+            return {
+                "answer": f"The knowledge base for {university_name} is still being prepared. Please try again in a moment.",
+                "status": status
+            }, 200
+
+    return None
+
+def embed_query(api_key, user_query):
+    """Embed a question in retrieval_query mode, reusing cached query embeddings"""
+    cache_key = (EMBEDDING_MODEL, normalize_query(user_query))
+    query_embedding = query_embedding_cache.get(cache_key)
+    metrics.record_cache('query_embedding', query_embedding is not None)
+    if query_embedding is None:
+        query_embedding = query_embedding_flight.do(cache_key, _embed_query_remote, api_key, user_query, cache_key)
+    return query_embedding
+
+def _embed_query_remote(api_key, user_query, cache_key):
+    embed_fn = GeminiEmbeddingFunction(api_key=api_key)
+    embed_fn.document_mode = False
+    with metrics.stage_timer('query_embedding'):
+        query_embedding = embed_fn([user_query])[0]
+    query_embedding_cache.put(cache_key, query_embedding)
+    return query_embedding
+
+def embed_queries(api_key, user_queries):
+    """Embed many questions at bulk priority in batched calls, reusing cached query embeddings"""
+    cache_keys = [(EMBEDDING_MODEL, normalize_query(user_query)) for user_query in user_queries]
+    query_embeddings = [query_embedding_cache.get(cache_key) for cache_key in cache_keys]
+    missing = [i for i, query_embedding in enumerate(query_embeddings) if query_embedding is None]
+    metrics.CACHE_REQUESTS.inc(len(cache_keys) - len(missing), cache='query_embedding', result='hit')
+    metrics.CACHE_REQUESTS.inc(len(missing), cache='query_embedding', result='miss')
+
+    if missing:
+        embed_fn = GeminiEmbeddingFunction(api_key=api_key, bulk=True)
         embed_fn.document_mode = False
+        with metrics.stage_timer('query_embedding'):
+            vectors = embed_fn([user_queries[i] for i in missing])
+        for i, vector in zip(missing, vectors):
+            query_embeddings[i] = vector
+            query_embedding_cache.put(cache_keys[i], vector)
+    return query_embeddings
+
+def invalid_custom_prompt(custom_prompt):
+    """Return an error message if a custom prompt isn't a string, else None"""
+    if custom_prompt is not None and not isinstance(custom_prompt, str):
+        return "custom_prompt must be text."
+    return None
+
+def get_prompt_variant(custom_prompt, retrieval_mode=RETRIEVAL_VECTOR):
+    """Identify the system prompt and retrieval mode an answer was generated with"""
+    if not custom_prompt or not custom_prompt.strip():
+        return f"{retrieval_mode}:default"
+    return f"{retrieval_mode}:{hashlib.sha256(custom_prompt.strip().encode('utf-8')).hexdigest()}"
+
+def lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding=None):
+    """Find a cached answer by exact question, or by similarity once the query is embedded"""
+    prompt_variant = get_prompt_variant(custom_prompt, retrieval_mode)
+    if query_embedding is None:
+        cached = answer_cache.get(university_name, prompt_variant, user_query)
+        metrics.record_cache('answer', cached is not None)
+        return cached
+    if not answer_cache.similarity_threshold:
+        return None
+    cached = answer_cache.get_similar(university_name, prompt_variant, query_embedding)
+    metrics.record_cache('semantic_answer', cached is not None)
+    return cached
+
+def store_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding, text, sources_text):
+    """Cache a generated answer and its formatted sources"""
+    if text:
+        answer_cache.put(university_name, get_prompt_variant(custom_prompt, retrieval_mode), user_query,
+                         {'text': text, 'sources': sources_text}, query_embedding)
+
+def invalid_retrieval_mode(requested_mode):
+    """Return an error message if a requested retrieval mode isn't a string, else None"""
+    if requested_mode is not None and not isinstance(requested_mode, str):
+        return f"retrieval_mode must be one of: {', '.join(RETRIEVAL_MODES)}."
+    return None
+
+def requested_retrieval_mode(requested_mode, university_name):
+    """Validate a requested retrieval mode; without a lexical index only vector search is possible"""
+    mode = (requested_mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES or registry.get_lexical_index(university_name) is None:
+        return RETRIEVAL_VECTOR
+    return mode
+
+def resolve_retrieval_mode(requested_mode, university_name):
+    """Pick the retrieval mode for a request, using lexical search until the vector index is ready"""
+    mode = requested_retrieval_mode(requested_mode, university_name)
+    if registry.get_lexical_index(university_name) is not None and get_index_status(university_name)['status'] != INDEX_READY:
+        return RETRIEVAL_LEXICAL
+    return mode
+
+def embed_query_for_mode(api_key, university_name, user_query, retrieval_mode):
+    """Embed the question if the mode needs it, returning (query_embedding, retrieval_mode).
+
+    When the embedding API fails (e.g. it is throttled), retrieval falls back
+    to the lexical index rather than failing the request.
+    """
+    if retrieval_mode == RETRIEVAL_LEXICAL:
+        return None, retrieval_mode
+    try:
+        return embed_query(api_key, user_query), retrieval_mode
+    except Exception as e:
+        if registry.get_lexical_index(university_name) is None:
+            raise
+        logger.warning(f"Query embedding failed, falling back to lexical retrieval: {e}")
+        return None, RETRIEVAL_LEXICAL
+
+def retrieve_passages(university_name, db, user_query, query_embedding, retrieval_mode=RETRIEVAL_VECTOR, n_results=CONTEXT_CANDIDATES):
+    """Search a university's indexes, returning scored candidate passages best first"""
+    return retrieve_passages_batch(university_name, db, [user_query], [query_embedding], retrieval_mode, n_results)[0]
+
+def retrieve_passages_batch(university_name, db, user_queries, query_embeddings, retrieval_mode=RETRIEVAL_VECTOR, n_results=CONTEXT_CANDIDATES):
+    """Search a university's indexes for several questions with a single vector query, returning a candidate list per question"""
+    metrics.annotate(retrieval_mode=retrieval_mode)
+    with metrics.stage_timer('retrieval'):
+        return _retrieve_passages(university_name, db, user_queries, query_embeddings, retrieval_mode, n_results)
 
-        # Search the Chroma DB using the specified query.
+def _lexical_candidates(university_name, user_query, n_results):
+    index = registry.get_lexical_index(university_name)
+    if index is None:
+        return []
+    positions, scores = index.search(user_query, n_results)
+    top_score = scores[0] if len(scores) else 1.0
+    return [{
+        'id': index.ids[i],
+        'document': index.documents[i],
+        'metadata': index.metadatas[i],
+        'score': float(score / top_score),
+        'embedding': None
+    } for i, score in zip(positions, scores)]
+
+def _vector_candidates(result, position, query_embedding):
+    """Turn one query's slice of a multi-query result into candidates scored by cosine similarity"""
+    retrieved_embeddings = result["embeddings"][position] if result["embeddings"] is not None else []
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
+    candidates = []
+    for passage_id, document, metadata, embedding in zip(result["ids"][position], result["documents"][position],
+                                                         result["metadatas"][position], retrieved_embeddings):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        candidates.append({
+            'id': passage_id,
+            'document': document,
+            'metadata': metadata,
+            'score': float(embedding @ query_vector / (np.linalg.norm(embedding) or 1.0)),
+            'embedding': embedding
+        })
+    return candidates
+
+def _fuse_lexical(university_name, user_query, candidates, n_results):
+    lexical = _lexical_candidates(university_name, user_query, n_results)
+    by_id = {candidate['id']: candidate for candidate in lexical}
+    by_id.update((candidate['id'], candidate) for candidate in candidates)
+    fused = reciprocal_rank_fusion([[c['id'] for c in candidates], [c['id'] for c in lexical]])[:n_results]
+    return [dict(by_id[passage_id], score=score) for passage_id, score in fused]
+
+def _retrieve_passages(university_name, db, user_queries, query_embeddings, retrieval_mode, n_results):
+    if retrieval_mode == RETRIEVAL_LEXICAL:
+        return [_lexical_candidates(university_name, user_query, n_results) for user_query in user_queries]
+
+    try:
+        result = db.query(query_embeddings=list(query_embeddings), n_results=n_results,
+                          include=['documents', 'metadatas', 'embeddings'])
+        candidate_lists = [_vector_candidates(result, i, query_embedding) for i, query_embedding in enumerate(query_embeddings)]
+    except Exception as e:
+        logger.error(f"ChromaDB query error: {e}")
+        candidate_lists = [[] for _ in user_queries]  # Continue without retrieved passages
+
+    if retrieval_mode == RETRIEVAL_HYBRID and registry.get_lexical_index(university_name) is not None:
+        candidate_lists = [_fuse_lexical(university_name, user_query, candidates, n_results)
+                           for user_query, candidates in zip(user_queries, candidate_lists)]
+
+    return candidate_lists
+
+def retrieve_context(university_name, db, user_query, query_embedding, retrieval_mode=RETRIEVAL_VECTOR):
+    """Retrieve candidates and trim them into the deduplicated, token-budgeted prompt context"""
+    return assemble_context(retrieve_passages(university_name, db, user_query, query_embedding, retrieval_mode))
+
+def assemble_context(candidates):
+    """Trim retrieved candidates into the prompt context"""
+    with metrics.stage_timer('context_assembly'):
+        context = build_context(
+            candidates,
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            max_passages=CONTEXT_MAX_PASSAGES,
+            score_margin=CONTEXT_SCORE_MARGIN,
+            duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+            mmr_lambda=CONTEXT_MMR_LAMBDA
+        )
+    metrics.annotate(candidates=len(candidates), passages=len(context.passages), context_tokens=context.token_count)
+    return context
+
+def validate_federated_request(payload):
+    """Validate a multi-university query payload, returning (error message, status code) or None"""
+    university_names = payload.get('university_names')
+
+    if not payload.get('query'):
+        return "Please provide a query.", 400
+
+    if not payload.get('api_key'):
+        return "Please provide your Google API key in the settings.", 400
+
+    if not isinstance(university_names, list) or not university_names or not all(isinstance(name, str) for name in university_names):
+        return "Please select at least one university.", 400
+
+    if len(set(university_names)) > FEDERATED_MAX_UNIVERSITIES:
+        return f"Please select at most {FEDERATED_MAX_UNIVERSITIES} universities.", 400
+
+    option_error = invalid_retrieval_mode(payload.get('retrieval_mode')) or invalid_custom_prompt(payload.get('custom_prompt'))
+    if option_error:
+        return option_error, 400
+
+    missing = [name for name in university_names if name not in registry]
+    if missing:
+        return f"These universities are no longer available: {', '.join(missing)}.", 400
+
+    # As for a single university, only wait on indexes that lexical search can't stand in for
+    preparing = []
+    for university_name in dict.fromkeys(university_names):
+        if get_index_status(university_name)['status'] != INDEX_READY:
+            status = schedule_indexing(university_name, payload['api_key'])
+            if status != INDEX_READY and registry.get_lexical_index(university_name) is None:
+                preparing.append(university_name)
+    if preparing:
+        return f"The knowledge base for {', '.join(preparing)} is still being prepared. Please try again in a moment.", 200
+
+    return None
+
+def resolve_federated_modes(requested_mode, university_names):
+    """Resolve each university's retrieval mode, returning an ordered {university: mode} dict"""
+    return OrderedDict((name, resolve_retrieval_mode(requested_mode, name)) for name in dict.fromkeys(university_names))
+
+def get_federated_mode_label(retrieval_modes):
+    """Name the mix of retrieval modes a federated answer was built with, for cache keys"""
+    return '+'.join(sorted(set(retrieval_modes.values())))
+
+def search_universities(api_key, retrieval_modes, user_query, n_results=CONTEXT_CANDIDATES):
+    """Search several universities with one query embedding, returning (merged candidates, modes used).
+
+    The query is embedded once and every university is searched in parallel;
+    each candidate carries the university_name it came from.
+    """
+    query_embedding = None
+    if any(mode != RETRIEVAL_LEXICAL for mode in retrieval_modes.values()):
         try:
-            result = db.query(query_texts=[user_query], n_results=15) # Retrieve top 15 passages
-            retrieved_documents = result["documents"][0] if result["documents"] else []
-            retrieved_metadatas = result["metadatas"][0] if result["metadatas"] else []
+            query_embedding = embed_query(api_key, user_query)
         except Exception as e:
-            logger.error(f"ChromaDB query error: {e}")
-            retrieved_documents = []  # Continue without retrieved passages
-            retrieved_metadatas = []
+            if any(registry.get_lexical_index(name) is None for name in retrieval_modes):
+                raise
+            logger.warning(f"Query embedding failed, falling back to lexical retrieval: {e}")
+            retrieval_modes = OrderedDict((name, RETRIEVAL_LEXICAL) for name in retrieval_modes)
 
-        # Construct the prompt for Gemini
-        query_oneline = user_query.replace("\n", " ")
+    metrics.annotate(universities=len(retrieval_modes), retrieval_mode=get_federated_mode_label(retrieval_modes))
+    with metrics.stage_timer('federated_retrieval'):
+        futures = [search_executor.submit(_search_university, api_key, name, user_query, query_embedding, mode, n_results)
+                   for name, mode in retrieval_modes.items()]
+        candidate_lists = [future.result() for future in futures]
+    return merge_candidates(candidate_lists, len(set(retrieval_modes.values())) > 1, n_results), retrieval_modes
 
-        # Use custom prompt if provided, otherwise use default
-        if custom_prompt:
-            base_prompt = custom_prompt.strip()
-        else:
-            base_prompt = f"""You are a helpful and informative bot that answers questions from undergraduate students asking about career services at {university_name} using text from the reference passage included below.
-                            Be sure to respond in a complete sentence, being comprehensive, including all relevant background information. Be sure to break down complicated concepts and
-                            strike a friendly and conversational tone. Give additional advice on top of the given text on how the student can maximize the value of the resource. If the passage is irrelevant to the answer, you may ignore it.
+def _search_university(api_key, university_name, user_query, query_embedding, retrieval_mode, n_results):
+    try:
+        db = get_or_create_collection(api_key, university_name) if retrieval_mode != RETRIEVAL_LEXICAL else None
+        candidates = retrieve_passages(university_name, db, user_query, query_embedding, retrieval_mode, n_results)
+    except Exception as e:
+        # One unavailable university shouldn't fail the others
+        logger.error(f"Search failed for {university_name}: {e}")
+        return []
+    for candidate in candidates:
+        candidate['university_name'] = university_name
+    return candidates
 
-                            **Please format your response using Markdown, including bullet points, bold text, and proper spacing where appropriate.**"""
+def merge_candidates(candidate_lists, mixed_modes, n_results):
+    """Merge per-university candidate lists best first"""
+    if mixed_modes:
+        # Scores from different retrieval modes aren't comparable, so fuse by rank instead
+        by_id = {candidate['id']: candidate for candidates in candidate_lists for candidate in candidates}
+        fused = reciprocal_rank_fusion([[candidate['id'] for candidate in candidates] for candidates in candidate_lists])
+        return [dict(by_id[passage_id], score=score) for passage_id, score in fused[:n_results]]
+    merged = [candidate for candidates in candidate_lists for candidate in candidates]
+    merged.sort(key=lambda candidate: candidate['score'], reverse=True)
+    return merged[:n_results]
 
-        prompt = f"""University: {university_name}. If anyone asks the university name or what university this is for answer with that.
-        {base_prompt}
+def build_prompt(university_name, user_query, custom_prompt, context):
+    """Construct the Gemini prompt from a built context, returning (prompt, source URLs)"""
+    with metrics.stage_timer('prompt_assembly'):
+        return _build_prompt(university_name, user_query, custom_prompt, context.documents, context.metadatas)
 
-        QUESTION: {query_oneline}
-        """
+def _base_prompt(university_name, custom_prompt):
+    # Use custom prompt if provided, otherwise use default
+    if custom_prompt:
+        return custom_prompt.strip()
+    return f"""You are a helpful and informative bot that answers questions from undergraduate students asking about career services at {university_name} using text from the reference passage included below.
+                        Be sure to respond in a complete sentence, being comprehensive, including all relevant background information. Be sure to break down complicated concepts and
+                        strike a friendly and conversational tone. Give additional advice on top of the given text on how the student can maximize the value of the resource. If the passage is irrelevant to the answer, you may ignore it.
+
+                        **Please format your response using Markdown, including bullet points, bold text, and proper spacing where appropriate.**"""
+
+def _source_url(metadata):
+    """A passage's source URL, or None if it has no usable one"""
+    url = metadata.get('rec_url') if metadata else None
+    if url and url.strip() and url.lower() not in ['nan', 'none', '']:
+        return url
+    return None
+
+def _build_prompt(university_name, user_query, custom_prompt, retrieved_documents, retrieved_metadatas):
+    query_oneline = user_query.replace("\n", " ")
+    base_prompt = _base_prompt(university_name, custom_prompt)
+
+    prompt = f"""University: {university_name}. If anyone asks the university name or what university this is for answer with that.
+    {base_prompt}
+
+    QUESTION: {query_oneline}
+    """
+    
+    # Add retrieved passages with their URLs to the prompt
+    sources = []
+    for i, (passage, metadata) in enumerate(zip(retrieved_documents, retrieved_metadatas)):
+        passage_oneline = passage.replace("\n", " ")
+        prompt += f"PASSAGE {i+1}: {passage_oneline}\n"
         
-        # Add retrieved passages with their URLs to the prompt
+        # Collect source URLs for reference
+        url = _source_url(metadata)
+        if url:
+            sources.append(url)
+
+    return prompt, sources
+
+def build_federated_prompt(university_names, user_query, custom_prompt, context):
+    """Construct a prompt over passages from several universities, returning (prompt, [(university, URL)])"""
+    with metrics.stage_timer('prompt_assembly'):
+        query_oneline = user_query.replace("\n", " ")
+        universities = ", ".join(university_names)
+        prompt = f"""Universities: {universities}. Each passage below is labelled with the university it comes from.
+    When comparing universities, say which university each point applies to, and say so when a university has no relevant passage.
+    {_base_prompt(universities, custom_prompt)}
+
+    QUESTION: {query_oneline}
+    """
+
         sources = []
-        for i, (passage, metadata) in enumerate(zip(retrieved_documents, retrieved_metadatas)):
-            passage_oneline = passage.replace("\n", " ")
-            prompt += f"PASSAGE {i+1}: {passage_oneline}\n"
-            
-            # Collect source URLs for reference
-            if metadata and metadata.get('rec_url'):
-                url = metadata['rec_url']
-                if url and url.strip() and url.lower() not in ['nan', 'none', '']:
-                    sources.append(url)
-        
-        try:
-            print(prompt)
+        for i, passage in enumerate(context.passages):
+            passage_oneline = passage['document'].replace("\n", " ")
+            prompt += f"PASSAGE {i+1} ({passage['university_name']}): {passage_oneline}\n"
+            url = _source_url(passage['metadata'])
+            if url:
+                sources.append((passage['university_name'], url))
+
+        return prompt, sources
+
+def format_sources(sources):
+    """Format source URLs as a Markdown block of links, or an empty string"""
+    with metrics.stage_timer('source_formatting'):
+        return _format_sources(sources)
+
+def _format_sources(sources):
+    if not sources:
+        return ""
+
+    unique_sources = list(dict.fromkeys(sources))  # Remove duplicates while preserving order
+    
+    # Format sources as HTML links that open in new tabs
+    formatted_links = [_source_link(url) for url in unique_sources]
+    return "\n\n**Sources:**\n\n" + "\n\n".join(formatted_links)
+
+def format_sources_by_university(sources):
+    """Format (university, URL) pairs as a Markdown block of links grouped under each university"""
+    with metrics.stage_timer('source_formatting'):
+        by_university = OrderedDict()
+        for university_name, url in sources:
+            by_university.setdefault(university_name, []).append(url)
+        if not by_university:
+            return ""
+        sections = [f"**{university_name}**\n\n" + "\n\n".join(_source_link(url) for url in dict.fromkeys(urls))
+                    for university_name, urls in by_university.items()]
+        return "\n\n**Sources:**\n\n" + "\n\n".join(sections)
+
+def _source_link(url):
+    # Create a display text from the URL (use domain or full URL)
+    try:
+        parsed = urlparse(url)
+        display_text = parsed.netloc if parsed.netloc else url
+    except:
+        display_text = url
+
+    # Create HTML link with styling
+    link_html = f'<a href="{url}" target="_blank" rel="noopener noreferrer" style="color: #007bff; text-decoration: underline; transition: color 0.3s ease;" onmouseover="this.style.color=\'#0056b3\'" onmouseout="this.style.color=\'#007bff\'" title="Click to open in new tab">{display_text}...</a>'
+    return link_html
+
+BUSY_MESSAGE = "The assistant is busy right now. Please try again in a moment."
+
+class GenerationError(Exception):
+    """A Gemini generation call failed, as opposed to retrieval or setup"""
+
+def describe_generation_error(e):
+    """Map a Gemini generation error to a user-facing message"""
+    error_str = str(e).lower()
+    if "api key" in error_str or "authentication" in error_str:
+        return "Invalid API key. Please check your Google API key in the settings."
+    elif "quota" in error_str or "limit" in error_str:
+        return "API quota exceeded. Please try again later or check your API key limits."
+    else:
+        return "Sorry, there was an issue generating the response. Please try again."
+
+def describe_general_error(e):
+    """Map a retrieval or setup error to a user-facing message"""
+    error_str = str(e).lower()
+    if "api key" in error_str or "authentication" in error_str or "invalid" in error_str:
+        return "Invalid API key. Please check your Google API key in the settings."
+    elif "database" in error_str:
+        return "Database temporarily unavailable. Please try again."
+    else:
+        return "Sorry, an error occurred. Please try again."
+
+def describe_error(e):
+    """Log a pipeline error and map it to a user-facing message"""
+    if isinstance(e, BusyError):
+        logger.warning(f"Gemini call rejected: {e}")
+        return BUSY_MESSAGE
+    if isinstance(e, GenerationError):
+        logger.error(f"Gemini API Error: {e}")
+        return describe_generation_error(e)
+    logger.error(f"General API Error: {e}")
+    return describe_general_error(e)
+
+def get_answer_key(university_name, custom_prompt, user_query, retrieval_mode):
+    """Key identical questions by the same fields the answer cache uses"""
+    return (university_name, get_prompt_variant(custom_prompt, retrieval_mode), normalize_query(user_query))
+
+def prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode=RETRIEVAL_VECTOR):
+    """Retrieve passages for a question and build its prompt, returning (prompt, sources)"""
+    # Get or create collection for selected university; lexical mode never touches Chroma
+    db = None
+    if retrieval_mode != RETRIEVAL_LEXICAL:
+        with metrics.stage_timer('collection'):
+            db = get_or_create_collection(api_key, university_name)
+
+    # Search the indexes using the specified query; sources come from exactly the passages used
+    context = retrieve_context(university_name, db, user_query, query_embedding, retrieval_mode)
+
+    return build_prompt(university_name, user_query, custom_prompt, context)
+
+def generation_slot(api_key, prompt, priority=PRIORITY_INTERACTIVE, timeout=INTERACTIVE_QUEUE_TIMEOUT):
+    """Queue a generation call behind the API key's rate limits"""
+    return gemini_scheduler.slot(api_key, 'generate', priority, tokens=estimate_tokens(prompt), timeout=timeout)
+
+def sse_event(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def generate_answer(api_key, prompt, priority=PRIORITY_INTERACTIVE, timeout=INTERACTIVE_QUEUE_TIMEOUT):
+    """Generate the answer text for a built prompt within the API key's rate limits"""
+    # Reuse the pooled client for the user's API key
+    client = get_genai_client(api_key)
+    try:
+        logger.debug(prompt)
+        with generation_slot(api_key, prompt, priority, timeout), metrics.stage_timer('generation'):
             gemini_answer = client.models.generate_content(
-                model="gemini-2.0-flash",
+                model=GENERATION_MODEL,
                 contents=prompt
             )
-            answer_text = gemini_answer.text
-            
-            # Append sources if available
-            if sources:
-                unique_sources = list(dict.fromkeys(sources))  # Remove duplicates while preserving order
-                
-                # Format sources as HTML links that open in new tabs
-                formatted_links = []
-                for url in unique_sources:
-                    # Create a display text from the URL (use domain or full URL)
-                    try:
-                        from urllib.parse import urlparse
-                        parsed = urlparse(url)
-                        display_text = parsed.netloc if parsed.netloc else url
-                    except:
-                        display_text = url
-                    
-                    # Create HTML link with styling
-                    link_html = f'<a href="{url}" target="_blank" rel="noopener noreferrer" style="color: #007bff; text-decoration: underline; transition: color 0.3s ease;" onmouseover="this.style.color=\'#0056b3\'" onmouseout="this.style.color=\'#007bff\'" title="Click to open in new tab">{display_text}...</a>'
-                    formatted_links.append(link_html)
-                
-                answer_text += f"\n\n**Sources:**\n\n{("\n\n").join(formatted_links)}"
-                
+    except BusyError:
+        raise
+    except Exception as e:
+        raise GenerationError(str(e)) from e
+    metrics.record_generation(prompt, gemini_answer.text, gemini_answer.usage_metadata)
+    return gemini_answer.text
+
+def answer_question(api_key, university_name, user_query, custom_prompt, retrieval_mode):
+    """Retrieve, generate and cache an answer, returning the answer text with its sources"""
+    query_embedding, retrieval_mode = embed_query_for_mode(api_key, university_name, user_query, retrieval_mode)
+    cached = lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding)
+    if cached:
+        return cached['text'] + cached['sources']
+
+    prompt, sources = prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode)
+
+    answer_text = generate_answer(api_key, prompt)
+    sources_text = format_sources(sources)
+    store_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding, answer_text, sources_text)
+    return answer_text + sources_text
+
+def stream_answer(api_key, university_name, user_query, custom_prompt, retrieval_mode):
+    """Yield ('token', text) and then ('sources', text) for a question, caching the finished answer"""
+    client = get_genai_client(api_key)
+
+    query_embedding, retrieval_mode = embed_query_for_mode(api_key, university_name, user_query, retrieval_mode)
+    cached = lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding)
+    if cached:
+        yield 'token', cached['text']
+        if cached['sources']:
+            yield 'sources', cached['sources']
+        return
+
+    prompt, sources = prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode)
+
+    answer_parts = []
+    usage_metadata = None
+    try:
+        with generation_slot(api_key, prompt), metrics.stage_timer('generation'):
+            for chunk in client.models.generate_content_stream(
+                model=GENERATION_MODEL,
+                contents=prompt
+            ):
+                usage_metadata = chunk.usage_metadata or usage_metadata
+                if chunk.text:
+                    answer_parts.append(chunk.text)
+                    yield 'token', chunk.text
+    except BusyError:
+        raise
+    except Exception as e:
+        raise GenerationError(str(e)) from e
+    metrics.record_generation(prompt, ''.join(answer_parts), usage_metadata)
+
+    sources_text = format_sources(sources)
+    store_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding, ''.join(answer_parts), sources_text)
+    if sources_text:
+        yield 'sources', sources_text
+
+def answer_federated_question(api_key, retrieval_modes, user_query, custom_prompt):
+    """Answer one question from several universities' passages, with sources grouped by university"""
+    candidates, retrieval_modes = search_universities(api_key, retrieval_modes, user_query)
+    prompt, sources = build_federated_prompt(list(retrieval_modes), user_query, custom_prompt, assemble_context(candidates))
+
+    answer_text = generate_answer(api_key, prompt)
+    sources_text = format_sources_by_university(sources)
+    store_cached_answer(tuple(sorted(retrieval_modes)), custom_prompt, user_query, get_federated_mode_label(retrieval_modes),
+                        None, answer_text, sources_text)
+    return answer_text + sources_text
+
+def ask_federated(payload):
+    """Answer an /ask payload naming several universities, returning (body, status code)"""
+    error = validate_federated_request(payload)
+    if error:
+        message, status_code = error
+        return {"answer": message}, status_code
+
+    user_query = payload.get('query')
+    custom_prompt = payload.get('custom_prompt')
+    api_key = payload.get('api_key')
+    retrieval_modes = resolve_federated_modes(payload.get('retrieval_mode'), payload['university_names'])
+
+    # Cached under the set of universities, which upload and delete invalidate along with each one
+    universities_key = tuple(sorted(retrieval_modes))
+    mode_label = get_federated_mode_label(retrieval_modes)
+    cached = lookup_cached_answer(universities_key, custom_prompt, user_query, mode_label)
+    if cached:
+        return {"answer": cached['text'] + cached['sources']}, 200
+
+    try:
+        answer_text = answer_flight.do(
+            get_answer_key(universities_key, custom_prompt, user_query, mode_label),
+            answer_federated_question, api_key, retrieval_modes, user_query, custom_prompt
+        )
+    except BusyError as e:
+        return {"answer": describe_error(e)}, 503
+    except Exception as e:
+        answer_text = describe_error(e)
+
+    return {"answer": answer_text}, 200
+
+def batch_result(question, index, **fields):
+    """One JSON-lines record of a batch, identifying the question it answers"""
+    return {'index': index, 'id': question.get('id'), 'university_name': question.get('university_name'),
+            'query': question.get('query'), **fields}
+
+def answer_batch(api_key, questions, custom_prompt=None, retrieval_mode=None, max_workers=BATCH_MAX_CONCURRENCY):
+    """Answer many {'university_name', 'query', 'id'} questions, yielding a result for each as it finishes.
+
+    Identical questions are answered once, uncached questions are embedded in
+    batched calls, each university is searched with one multi-query lookup,
+    and answers are generated on max_workers threads at bulk priority so
+    interactive questions still go first.
+    """
+    groups = OrderedDict()
+    for index, question in enumerate(questions):
+        university_name = question.get('university_name')
+        user_query = question.get('query')
+        if not user_query or not isinstance(user_query, str):
+            yield batch_result(question, index, error="Please provide a query.")
+            continue
+        if not isinstance(university_name, str) or university_name not in registry:
+            yield batch_result(question, index, error="The selected university is not available.")
+            continue
+        # Offline batches wait for the vector index rather than answering lexically meanwhile
+        mode = requested_retrieval_mode(retrieval_mode, university_name)
+        group = groups.setdefault(get_answer_key(university_name, custom_prompt, user_query, mode), {
+            'university_name': university_name, 'query': user_query, 'mode': mode, 'embedding': None, 'indices': []
+        })
+        group['indices'].append(index)
+    metrics.annotate(questions=len(questions), unique_questions=len(groups))
+
+    def group_results(group, **fields):
+        for index in group['indices']:
+            yield batch_result(questions[index], index, **fields)
+
+    pending = []
+    for group in groups.values():
+        cached = lookup_cached_answer(group['university_name'], custom_prompt, group['query'], group['mode'])
+        if cached:
+            yield from group_results(group, answer=cached['text'], sources=cached['sources'], cached=True)
+        else:
+            pending.append(group)
+
+    # Every question that needs a vector search is embedded up front in batched calls
+    unique_queries = OrderedDict()
+    for group in pending:
+        if group['mode'] != RETRIEVAL_LEXICAL:
+            unique_queries.setdefault(normalize_query(group['query']), group['query'])
+    query_embeddings, embedding_error = {}, None
+    if unique_queries:
+        try:
+            query_embeddings = dict(zip(unique_queries, embed_queries(api_key, list(unique_queries.values()))))
         except Exception as e:
-            logger.error(f"Gemini API Error: {e}")
-            # More specific error messages
-            error_str = str(e).lower()
-            if "api key" in error_str or "authentication" in error_str:
-                answer_text = "Invalid API key. Please check your Google API key in the settings."
-            elif "quota" in error_str or "limit" in error_str:
-                answer_text = "API quota exceeded. Please try again later or check your API key limits."
+            logger.warning(f"Batch query embedding failed, falling back to lexical retrieval: {e}")
+            embedding_error = e
+
+    ready = []
+    for group in pending:
+        if group['mode'] != RETRIEVAL_LEXICAL:
+            group['embedding'] = query_embeddings.get(normalize_query(group['query']))
+            if group['embedding'] is None:
+                if registry.get_lexical_index(group['university_name']) is None:
+                    yield from group_results(group, error=describe_error(embedding_error))
+                    continue
+                group['mode'] = RETRIEVAL_LEXICAL
             else:
-                answer_text = "Sorry, there was an issue generating the response. Please try again."
+                cached = lookup_cached_answer(group['university_name'], custom_prompt, group['query'], group['mode'], group['embedding'])
+                if cached:
+                    yield from group_results(group, answer=cached['text'], sources=cached['sources'], cached=True)
+                    continue
+        ready.append(group)
+
+    by_university = OrderedDict()
+    for group in ready:
+        by_university.setdefault(group['university_name'], []).append(group)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+    try:
+        # Retrieval runs once per university; its questions are then generated independently
+        futures = {executor.submit(prepare_batch_prompts, api_key, name, university_groups, custom_prompt): university_groups
+                   for name, university_groups in by_university.items()}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                work = futures.pop(future)
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    message = describe_error(e)
+                    for group in (work if isinstance(work, list) else [work]):
+                        yield from group_results(group, error=message)
+                    continue
+                if isinstance(work, list):
+                    for group in work:
+                        futures[executor.submit(generate_batch_answer, api_key, group, custom_prompt)] = group
+                else:
+                    yield from group_results(work, answer=answer['text'], sources=answer['sources'], cached=False)
+    finally:
+        # A client that disconnects mid-batch shouldn't keep the queued questions running
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def prepare_batch_prompts(api_key, university_name, groups, custom_prompt):
+    """Retrieve passages for all of a university's batch questions and build their prompts"""
+    db = None
+    if any(group['mode'] != RETRIEVAL_LEXICAL for group in groups):
+        with metrics.stage_timer('collection'):
+            db = get_or_create_collection(api_key, university_name)
+
+    for mode in OrderedDict.fromkeys(group['mode'] for group in groups):
+        same_mode = [group for group in groups if group['mode'] == mode]
+        candidate_lists = retrieve_passages_batch(university_name, db, [group['query'] for group in same_mode],
+                                                  [group['embedding'] for group in same_mode], mode)
+        for group, candidates in zip(same_mode, candidate_lists):
+            group['prompt'], group['sources'] = build_prompt(university_name, group['query'], custom_prompt,
+                                                             assemble_context(candidates))
+
+def generate_batch_answer(api_key, group, custom_prompt):
+    """Generate and cache one batch answer at bulk priority"""
+    answer_text = generate_answer(api_key, group['prompt'], PRIORITY_BULK, BULK_QUEUE_TIMEOUT)
+    sources_text = format_sources(group['sources'])
+    store_cached_answer(group['university_name'], custom_prompt, group['query'], group['mode'], group['embedding'],
+                        answer_text, sources_text)
+    return {'text': answer_text, 'sources': sources_text}
 
+@app.route('/ask', methods=['POST'])
+@metrics.traced('/ask')
+def ask_chatbot():
+    # Several universities are searched together and answered from their merged passages
+    if request.json.get('university_names') is not None:
+        body, status_code = ask_federated(request.json)
+        return jsonify(body), status_code
+
+    error = validate_ask_request(request.json)
+    if error:
+        body, status_code = error
+        return jsonify(body), status_code
+
+    user_query = request.json.get('query')
+    custom_prompt = request.json.get('custom_prompt')
+    api_key = request.json.get('api_key')
+    university_name = request.json.get('university_name')
+    retrieval_mode = resolve_retrieval_mode(request.json.get('retrieval_mode'), university_name)
+
+    # Repeated questions are answered straight from the cache
+    cached = lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode)
+    if cached:
+        return jsonify({"answer": cached['text'] + cached['sources']})
+
+    try:
+        # Identical questions already in flight share one retrieval and generation
+        answer_text = answer_flight.do(
+            get_answer_key(university_name, custom_prompt, user_query, retrieval_mode),
+            answer_question, api_key, university_name, user_query, custom_prompt, retrieval_mode
+        )
+    except BusyError as e:
+        # Queued past the deadline: answer now rather than hold the request open
+        return jsonify({"answer": describe_error(e)}), 503
     except Exception as e:
-        logger.error(f"General API Error: {e}")
-        # Handle various error types
-        error_str = str(e).lower()
-        if "api key" in error_str or "authentication" in error_str or "invalid" in error_str:
-            answer_text = "Invalid API key. Please check your Google API key in the settings."
-        elif "database" in error_str:
-            answer_text = "Database temporarily unavailable. Please try again."
-        else:
-            answer_text = "Sorry, an error occurred. Please try again."
+        answer_text = describe_error(e)
 
     return jsonify({"answer": answer_text})
 
+@app.route('/ask/stream', methods=['POST'])
+def ask_chatbot_stream():
+    """Stream the answer as Server-Sent Events: token events, then sources, then done"""
+    error = validate_ask_request(request.json)
+    if error:
+        body, status_code = error
+        return jsonify(body), status_code
+
+    user_query = request.json.get('query')
+    custom_prompt = request.json.get('custom_prompt')
+    api_key = request.json.get('api_key')
+    university_name = request.json.get('university_name')
+    retrieval_mode = resolve_retrieval_mode(request.json.get('retrieval_mode'), university_name)
+
+    @metrics.traced('/ask/stream')
+    def generate():
+        cached = lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode)
+        if cached:
+            yield sse_event('token', {'text': cached['text']})
+            if cached['sources']:
+                yield sse_event('sources', {'text': cached['sources']})
+            yield sse_event('done', {})
+            return
+
+        try:
+            # Identical questions already in flight replay the same generated stream
+            for event, text in answer_stream_flight.stream(
+                get_answer_key(university_name, custom_prompt, user_query, retrieval_mode),
+                stream_answer, api_key, university_name, user_query, custom_prompt, retrieval_mode
+            ):
+                if event == 'token':
+                    metrics.mark_first_token()
+                yield sse_event(event, {'text': text})
+        except Exception as e:
+            yield sse_event('error', {'text': describe_error(e)})
+
+        yield sse_event('done', {})
+
+    # Disable proxy buffering so tokens reach the browser as they are generated
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/ask/batch', methods=['POST'])
+def ask_batch():
+    """Answer many questions at once, streaming one JSON object per line as answers finish"""
+    payload = request.get_json(silent=True) or {}
+    api_key = payload.get('api_key')
+    questions = payload.get('questions')
+
+    if not api_key:
+        return jsonify({"error": "Please provide your Google API key."}), 400
+    if not isinstance(questions, list) or not questions or not all(isinstance(question, dict) for question in questions):
+        return jsonify({"error": "Please provide a list of questions, each with a university_name and query."}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions can be sent in one batch."}), 400
+    option_error = invalid_retrieval_mode(payload.get('retrieval_mode')) or invalid_custom_prompt(payload.get('custom_prompt'))
+    if option_error:
+        return jsonify({"error": option_error}), 400
+
+    @metrics.traced('/api/ask/batch')
+    def generate():
+        for result in answer_batch(api_key, questions, payload.get('custom_prompt'), payload.get('retrieval_mode')):
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/search', methods=['POST'])
+@metrics.traced('/api/search')
+def search():
+    """Search one or more universities, returning passages merged by score with their university"""
+    payload = request.get_json(silent=True) or {}
+    if payload.get('university_names') is None and payload.get('university_name'):
+        payload['university_names'] = [payload['university_name']]
+    error = validate_federated_request(payload)
+    if error:
+        message, status_code = error
+        return jsonify({"error": message}), status_code
+
+    try:
+        n_results = max(1, min(int(payload.get('n_results') or 10), SEARCH_MAX_RESULTS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "n_results must be a number."}), 400
+
+    retrieval_modes = resolve_federated_modes(payload.get('retrieval_mode'), payload['university_names'])
+    try:
+        candidates, retrieval_modes = search_universities(payload['api_key'], retrieval_modes, payload['query'], n_results)
+    except BusyError as e:
+        return jsonify({"error": describe_error(e)}), 503
+    except Exception as e:
+        return jsonify({"error": describe_error(e)}), 500
+
+    return jsonify({
+        "query": payload['query'],
+        "retrieval_modes": retrieval_modes,
+        "results": [{
+            "university_name": candidate['university_name'],
+            "id": candidate['id'],
+            "score": candidate['score'],
+            "document": candidate['document'],
+            "rec_id": (candidate['metadata'] or {}).get('rec_id'),
+            "rec_url": _source_url(candidate['metadata']),
+            "description": (candidate['metadata'] or {}).get('description')
+        } for candidate in candidates]
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose pipeline metrics in Prometheus text format"""
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # Preload CSV files from data directory when module is imported
 logger.info("Preloading CSV files from data directory...")
 preload_csv_files()
+start_background_indexing()
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,266 @@
+# asgi.py
+"""Async serving mode for the chatbot.
+
+Run with ``uvicorn asgi:app``. /ask and /ask/stream are served natively on the
+event loop using the async genai client, with Chroma work pushed to worker
+threads. Every other route is passed through to the Flask app unchanged.
+"""
+import asyncio
+import logging
+
+from a2wsgi import WSGIMiddleware
+from google.genai import types
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as chatbot
+import metrics
+from context_builder import estimate_tokens
+from scheduler import PRIORITY_INTERACTIVE, BusyError
+from singleflight import AsyncSingleFlight, AsyncStreamFlight
+
+logger = logging.getLogger(__name__)
+
+# Event-loop counterparts of app's flights; collection builds share app's thread-based one
+query_embedding_flight = AsyncSingleFlight('query_embedding')
+answer_flight = AsyncSingleFlight('answer')
+answer_stream_flight = AsyncStreamFlight('answer_stream')
+
+
+def generation_slot(api_key, prompt):
+    """Async counterpart of app.generation_slot, waiting on the same per-key limits"""
+    return chatbot.gemini_scheduler.async_slot(api_key, 'generate', PRIORITY_INTERACTIVE, tokens=estimate_tokens(prompt),
+                                               timeout=chatbot.INTERACTIVE_QUEUE_TIMEOUT)
+
+
+async def _embed_query_remote(api_key, user_query):
+    # Like app's query embeddings this fails fast when throttled; retrieval falls back to lexical
+    client = chatbot.get_genai_client(api_key)
+    async with chatbot.gemini_scheduler.async_slot(api_key, 'embed', PRIORITY_INTERACTIVE, tokens=estimate_tokens(user_query),
+                                                   timeout=chatbot.INTERACTIVE_QUEUE_TIMEOUT):
+        response = await client.aio.models.embed_content(
+            model=chatbot.EMBEDDING_MODEL,
+            contents=[user_query],
+            config=types.EmbedContentConfig(
+                task_type="retrieval_query",
+            ),
+        )
+    return response.embeddings[0].values
+
+
+async def embed_query(api_key, user_query):
+    """Embed a question in retrieval_query mode with the async client, sharing app's query cache"""
+    cache_key = (chatbot.EMBEDDING_MODEL, chatbot.normalize_query(user_query))
+    query_embedding = chatbot.query_embedding_cache.get(cache_key)
+    metrics.record_cache('query_embedding', query_embedding is not None)
+    if query_embedding is None:
+        query_embedding = await query_embedding_flight.do(cache_key, _embed_and_cache_query, api_key, user_query, cache_key)
+    return query_embedding
+
+
+async def _embed_and_cache_query(api_key, user_query, cache_key):
+    with metrics.stage_timer('query_embedding'):
+        query_embedding = await _embed_query_remote(api_key, user_query)
+    chatbot.query_embedding_cache.put(cache_key, query_embedding)
+    return query_embedding
+
+
+async def embed_query_for_mode(api_key, university_name, user_query, retrieval_mode):
+    """Async counterpart of app.embed_query_for_mode, returning (query_embedding, retrieval_mode)"""
+    if retrieval_mode == chatbot.RETRIEVAL_LEXICAL:
+        return None, retrieval_mode
+    try:
+        return await embed_query(api_key, user_query), retrieval_mode
+    except Exception as e:
+        # An evicted university's BM25 index is rebuilt from its CSV, so keep that off the loop
+        if await asyncio.to_thread(chatbot.registry.get_lexical_index, university_name) is None:
+            raise
+        logger.warning(f"Query embedding failed, falling back to lexical retrieval: {e}")
+        return None, chatbot.RETRIEVAL_LEXICAL
+
+
+async def prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode):
+    """Async counterpart of app.prepare_answer, returning (prompt, sources)"""
+    # Collection lookup and the vector search are blocking Chroma calls
+    db = None
+    if retrieval_mode != chatbot.RETRIEVAL_LEXICAL:
+        with metrics.stage_timer('collection'):
+            db = await asyncio.to_thread(chatbot.get_or_create_collection, api_key, university_name)
+    context = await asyncio.to_thread(
+        chatbot.retrieve_context, university_name, db, user_query, query_embedding, retrieval_mode
+    )
+
+    return chatbot.build_prompt(university_name, user_query, custom_prompt, context)
+
+
+async def answer_question(api_key, university_name, user_query, custom_prompt, retrieval_mode):
+    """Async counterpart of app.answer_question"""
+    client = chatbot.get_genai_client(api_key)
+    query_embedding, retrieval_mode = await embed_query_for_mode(api_key, university_name, user_query, retrieval_mode)
+    cached = chatbot.lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding)
+    if cached:
+        return cached['text'] + cached['sources']
+
+    prompt, sources = await prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode)
+
+    try:
+        async with generation_slot(api_key, prompt):
+            with metrics.stage_timer('generation'):
+                gemini_answer = await client.aio.models.generate_content(
+                    model=chatbot.GENERATION_MODEL,
+                    contents=prompt
+                )
+    except BusyError:
+        raise
+    except Exception as e:
+        raise chatbot.GenerationError(str(e)) from e
+    metrics.record_generation(prompt, gemini_answer.text, gemini_answer.usage_metadata)
+    sources_text = chatbot.format_sources(sources)
+    chatbot.store_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding, gemini_answer.text, sources_text)
+    return gemini_answer.text + sources_text
+
+
+async def stream_answer(api_key, university_name, user_query, custom_prompt, retrieval_mode):
+    """Async counterpart of app.stream_answer"""
+    client = chatbot.get_genai_client(api_key)
+    query_embedding, retrieval_mode = await embed_query_for_mode(api_key, university_name, user_query, retrieval_mode)
+    cached = chatbot.lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding)
+    if cached:
+        yield 'token', cached['text']
+        if cached['sources']:
+            yield 'sources', cached['sources']
+        return
+
+    prompt, sources = await prepare_answer(api_key, university_name, user_query, custom_prompt, query_embedding, retrieval_mode)
+
+    answer_parts = []
+    usage_metadata = None
+    try:
+        async with generation_slot(api_key, prompt):
+            with metrics.stage_timer('generation'):
+                async for chunk in await client.aio.models.generate_content_stream(
+                    model=chatbot.GENERATION_MODEL,
+                    contents=prompt
+                ):
+                    usage_metadata = chunk.usage_metadata or usage_metadata
+                    if chunk.text:
+                        answer_parts.append(chunk.text)
+                        yield 'token', chunk.text
+    except BusyError:
+        raise
+    except Exception as e:
+        raise chatbot.GenerationError(str(e)) from e
+    metrics.record_generation(prompt, ''.join(answer_parts), usage_metadata)
+
+    sources_text = chatbot.format_sources(sources)
+    chatbot.store_cached_answer(university_name, custom_prompt, user_query, retrieval_mode, query_embedding, ''.join(answer_parts), sources_text)
+    if sources_text:
+        yield 'sources', sources_text
+
+
+async def read_ask_request(request, allow_federated=False):
+    """Parse and validate an /ask payload, returning (payload, error response)"""
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = None
+    if not isinstance(payload, dict):
+        return None, JSONResponse({"answer": "Please provide a query."}, status_code=400)
+    if allow_federated and payload.get('university_names') is not None:
+        # Multi-university payloads are validated by app.ask_federated
+        return payload, None
+
+    # Validation may read Chroma to check readiness, so keep it off the loop
+    error = await asyncio.to_thread(chatbot.validate_ask_request, payload)
+    if error:
+        body, status_code = error
+        return payload, JSONResponse(body, status_code=status_code)
+    return payload, None
+
+
+@metrics.traced('/ask')
+async def ask_chatbot(request):
+    payload, error_response = await read_ask_request(request, allow_federated=True)
+    if error_response:
+        return error_response
+
+    if payload.get('university_names') is not None:
+        # The parallel fan-out over collections runs on app's search threads
+        body, status_code = await asyncio.to_thread(chatbot.ask_federated, payload)
+        return JSONResponse(body, status_code=status_code)
+
+    user_query = payload.get('query')
+    custom_prompt = payload.get('custom_prompt')
+    api_key = payload.get('api_key')
+    university_name = payload.get('university_name')
+    retrieval_mode = await asyncio.to_thread(chatbot.resolve_retrieval_mode, payload.get('retrieval_mode'), university_name)
+
+    # Repeated questions are answered straight from the cache
+    cached = chatbot.lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode)
+    if cached:
+        return JSONResponse({"answer": cached['text'] + cached['sources']})
+
+    try:
+        # Identical questions already in flight share one retrieval and generation
+        answer_text = await answer_flight.do(
+            chatbot.get_answer_key(university_name, custom_prompt, user_query, retrieval_mode),
+            answer_question, api_key, university_name, user_query, custom_prompt, retrieval_mode
+        )
+    except BusyError as e:
+        return JSONResponse({"answer": chatbot.describe_error(e)}, status_code=503)
+    except Exception as e:
+        answer_text = chatbot.describe_error(e)
+
+    return JSONResponse({"answer": answer_text})
+
+
+async def ask_chatbot_stream(request):
+    """Stream the answer as Server-Sent Events: token events, then sources, then done"""
+    payload, error_response = await read_ask_request(request)
+    if error_response:
+        return error_response
+
+    user_query = payload.get('query')
+    custom_prompt = payload.get('custom_prompt')
+    api_key = payload.get('api_key')
+    university_name = payload.get('university_name')
+    retrieval_mode = await asyncio.to_thread(chatbot.resolve_retrieval_mode, payload.get('retrieval_mode'), university_name)
+
+    @metrics.traced('/ask/stream')
+    async def generate():
+        cached = chatbot.lookup_cached_answer(university_name, custom_prompt, user_query, retrieval_mode)
+        if cached:
+            yield chatbot.sse_event('token', {'text': cached['text']})
+            if cached['sources']:
+                yield chatbot.sse_event('sources', {'text': cached['sources']})
+            yield chatbot.sse_event('done', {})
+            return
+
+        try:
+            # Identical questions already in flight replay the same generated stream
+            async for event, text in answer_stream_flight.stream(
+                chatbot.get_answer_key(university_name, custom_prompt, user_query, retrieval_mode),
+                stream_answer, api_key, university_name, user_query, custom_prompt, retrieval_mode
+            ):
+                if event == 'token':
+                    metrics.mark_first_token()
+                yield chatbot.sse_event(event, {'text': text})
+        except Exception as e:
+            yield chatbot.sse_event('error', {'text': chatbot.describe_error(e)})
+
+        yield chatbot.sse_event('done', {})
+
+    # Disable proxy buffering so tokens reach the browser as they are generated
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+app = Starlette(routes=[
+    Route('/ask', ask_chatbot, methods=['POST']),
+    Route('/ask/stream', ask_chatbot_stream, methods=['POST']),
+    # Uploads, deletes, the UI and static files keep running on Flask
+    Mount('/', app=WSGIMiddleware(chatbot.app)),
+])
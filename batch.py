@@ -0,0 +1,75 @@
+# batch.py
+"""Answer a file of questions offline, writing one JSON object per line.
+
+Questions are read from a JSON-lines file (one {"university_name", "query",
+"id"} object per line) or a CSV with those columns, and answered with the
+same pipeline as /api/ask/batch: identical questions are answered once,
+queries are embedded in batched calls, each university is searched once and
+answers are generated in parallel within the API key's rate limits.
+
+Example:
+    python batch.py questions.jsonl --api-key $GOOGLE_API_KEY --output answers.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='Questions as .jsonl or .csv; "-" reads JSON lines from stdin')
+    parser.add_argument('--output', default='-', help='Where to write JSON-lines results (default: stdout)')
+    parser.add_argument('--api-key', default=os.environ.get('GOOGLE_API_KEY') or os.environ.get('GEMINI_API_KEY'),
+                        help='Google API key (default: $GOOGLE_API_KEY or $GEMINI_API_KEY)')
+    parser.add_argument('--university', help='University for questions that do not name one')
+    parser.add_argument('--custom-prompt', help='System prompt used instead of the default')
+    parser.add_argument('--retrieval-mode', choices=['vector', 'lexical', 'hybrid'], default=None)
+    parser.add_argument('--concurrency', type=int, default=None, help='Questions worked on at once')
+    return parser.parse_args()
+
+
+def read_questions(path):
+    """Read question dicts from a JSON-lines or CSV file"""
+    if path == '-':
+        return [json.loads(line) for line in sys.stdin if line.strip()]
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.csv'):
+            return [dict(row) for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    args = parse_args()
+    if not args.api_key:
+        sys.exit("An API key is required: pass --api-key or set GOOGLE_API_KEY")
+
+    questions = read_questions(args.input)
+    if args.university:
+        for question in questions:
+            if not question.get('university_name'):
+                question['university_name'] = args.university
+
+    # Imported late so --help works without loading every university
+    import app
+
+    options = {'max_workers': args.concurrency} if args.concurrency else {}
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    answered = failed = 0
+    try:
+        for result in app.answer_batch(args.api_key, questions, args.custom_prompt, args.retrieval_mode, **options):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+            if 'error' in result:
+                failed += 1
+            else:
+                answered += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Answered {answered} of {len(questions)} questions ({failed} failed)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# benchmarks/fake_genai.py
+"""Local stand-in for the Gemini API used by the benchmarks.
+
+FakeClient mimics the parts of ``genai.Client`` the app uses (sync and async
+embed_content, generate_content and generate_content_stream) with
+configurable latency, random failures and 429s, and deterministic
+embeddings, so performance can be measured without keys or network access.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+from google import genai
+from google.genai import errors
+
+EMBEDDING_DIMENSIONS = 768
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class FakeSettings:
+    """Latency and failure knobs shared by every FakeClient"""
+
+    def __init__(self, embed_latency=0.05, embed_latency_per_item=0.0005, generate_latency=0.8,
+                 stream_chunks=20, error_rate=0.0, rate_limit_rate=0.0, max_batch_size=100, seed=0):
+        self.embed_latency = embed_latency
+        self.embed_latency_per_item = embed_latency_per_item
+        self.generate_latency = generate_latency
+        self.stream_chunks = stream_chunks
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_batch_size = max_batch_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {'embed_content': 0, 'embedded_items': 0, 'generate_content': 0, 'errors': 0, 'rate_limited': 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.calls[name] += amount
+
+    def maybe_fail(self):
+        """Raise a 429 or 500 APIError according to the configured rates"""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.count('rate_limited')
+            raise errors.ClientError(429, httpx.Response(429, json={
+                'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).', 'status': 'RESOURCE_EXHAUSTED'}
+            }))
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.count('errors')
+            raise errors.ServerError(500, httpx.Response(500, json={
+                'error': {'code': 500, 'message': 'Internal error encountered.', 'status': 'INTERNAL'}
+            }))
+
+
+settings = FakeSettings()
+
+
+def fake_embedding(text):
+    """Deterministic embedding: normalized sum of per-token pseudo-random vectors.
+
+    Texts that share words get similar vectors, so retrieval results are
+    meaningful enough for ranking-sensitive code paths.
+    """
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for token in TOKEN_PATTERN.findall(str(text).lower()) or ['<empty>']:
+        seed = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+        vector += np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def _embed_response(contents):
+    if isinstance(contents, str):
+        contents = [contents]
+    if len(contents) > settings.max_batch_size:
+        raise errors.ClientError(400, httpx.Response(400, json={
+            'error': {'code': 400, 'message': f'At most {settings.max_batch_size} requests can be in one batch.', 'status': 'INVALID_ARGUMENT'}
+        }))
+    return SimpleNamespace(embeddings=[SimpleNamespace(values=fake_embedding(text)) for text in contents])
+
+
+def _answer_text(contents):
+    question = re.search(r'QUESTION: (.*)', str(contents))
+    topic = question.group(1).strip() if question else 'your question'
+    return f"Here is what I found about **{topic}**. " + "The career center can help with this. " * 8
+
+
+def _usage(contents, text):
+    return SimpleNamespace(prompt_token_count=len(str(contents)) // 4, candidates_token_count=len(text) // 4)
+
+
+class FakeModels:
+    def embed_content(self, *, model, contents, config=None):
+        _count_embedding(contents)
+        time.sleep(settings.embed_latency + settings.embed_latency_per_item * _batch_size(contents))
+        settings.maybe_fail()
+        return _embed_response(contents)
+
+    def generate_content(self, *, model, contents, config=None):
+        settings.count('generate_content')
+        time.sleep(settings.generate_latency)
+        settings.maybe_fail()
+        text = _answer_text(contents)
+        return SimpleNamespace(text=text, usage_metadata=_usage(contents, text))
+
+    def generate_content_stream(self, *, model, contents, config=None):
+        settings.count('generate_content')
+        settings.maybe_fail()
+        text = _answer_text(contents)
+        chunks = _split(text, settings.stream_chunks)
+        for i, chunk in enumerate(chunks):
+            time.sleep(settings.generate_latency / len(chunks))
+            yield SimpleNamespace(text=chunk, usage_metadata=_usage(contents, text) if i == len(chunks) - 1 else None)
+
+
+class FakeAsyncModels:
+    async def embed_content(self, *, model, contents, config=None):
+        _count_embedding(contents)
+        await asyncio.sleep(settings.embed_latency + settings.embed_latency_per_item * _batch_size(contents))
+        settings.maybe_fail()
+        return _embed_response(contents)
+
+    async def generate_content(self, *, model, contents, config=None):
+        settings.count('generate_content')
+        await asyncio.sleep(settings.generate_latency)
+        settings.maybe_fail()
+        text = _answer_text(contents)
+        return SimpleNamespace(text=text, usage_metadata=_usage(contents, text))
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        settings.count('generate_content')
+        settings.maybe_fail()
+        text = _answer_text(contents)
+        chunks = _split(text, settings.stream_chunks)
+
+        async def stream():
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(settings.generate_latency / len(chunks))
+                yield SimpleNamespace(text=chunk, usage_metadata=_usage(contents, text) if i == len(chunks) - 1 else None)
+        return stream()
+
+
+def _batch_size(contents):
+    return 1 if isinstance(contents, str) else len(contents)
+
+
+def _count_embedding(contents):
+    settings.count('embed_content')
+    settings.count('embedded_items', _batch_size(contents))
+
+
+def _split(text, parts):
+    size = max(1, len(text) // max(parts, 1))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeClient:
+    """Drop-in replacement for genai.Client"""
+
+    def __init__(self, api_key=None, **kwargs):
+        self.api_key = api_key
+        self.models = FakeModels()
+        self.aio = SimpleNamespace(models=FakeAsyncModels())
+
+
+def install(fake_settings=None):
+    """Replace genai.Client with FakeClient; call before the app makes any client"""
+    global settings
+    if fake_settings is not None:
+        settings = fake_settings
+    genai.Client = FakeClient
+    return settings
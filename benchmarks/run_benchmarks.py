@@ -0,0 +1,281 @@
+# benchmarks/run_benchmarks.py
+"""Benchmark and load-test harness for the chatbot.
+
+Runs entirely offline against benchmarks/fake_genai.py: no API key or network
+access is needed. Covers CSV ingestion (preload and upload), collection build
+time and /ask throughput and latency percentiles under concurrent load, using
+the shipped data/*.csv files plus synthetically scaled copies.
+
+Example:
+    python benchmarks/run_benchmarks.py --scales 10000,100000 --requests 500 --concurrency 32
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import fake_genai  # noqa: E402
+import ingestion  # noqa: E402
+
+BENCH_API_KEY = 'benchmark-key'
+
+SAMPLE_QUESTIONS = [
+    "How do I get a resume review?",
+    "Where can I practice mock interviews?",
+    "How do I write a cover letter?",
+    "What career communities are there?",
+    "How do I find an internship?",
+    "Can alumni help me with networking?",
+    "How do I negotiate a job offer salary?",
+    "What resources exist for graduate school applications?",
+    "How do I schedule an appointment with a career advisor?",
+    "Is there help with LinkedIn profiles?",
+    "What should first-year students do to prepare for careers?",
+    "How do I use Handshake?",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10000',
+                        help='Comma-separated row counts for synthetic CSVs (e.g. 10000,100000,1000000); empty to skip')
+    parser.add_argument('--requests', type=int, default=200, help='Number of /ask requests in the load test')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent /ask requests in flight')
+    parser.add_argument('--server', choices=['flask', 'asgi', 'both'], default='both', help='Which serving mode to load test')
+    parser.add_argument('--endpoint', choices=['/ask', '/ask/stream'], default='/ask')
+    parser.add_argument('--retrieval-mode', default=None, help='retrieval_mode sent with each question')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0,
+                        help='Fraction of questions repeated verbatim (exercises the answer cache)')
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='Fake seconds per embed_content call')
+    parser.add_argument('--embed-latency-per-item', type=float, default=0.0005, help='Fake extra seconds per embedded item')
+    parser.add_argument('--generate-latency', type=float, default=0.8, help='Fake seconds per generation')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability a fake call fails with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Probability a fake call fails with a 429')
+    parser.add_argument('--skip-collections', action='store_true', help='Skip building synthetic collections')
+    parser.add_argument('--json', dest='json_path', help='Write results to this JSON file')
+    return parser.parse_args()
+
+
+def summarize_latencies(latencies, wall_seconds):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'requests': int(latencies.size),
+        'throughput_rps': round(latencies.size / wall_seconds, 2) if wall_seconds else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'max_ms': round(float(latencies.max()), 2),
+    }
+
+
+def make_synthetic_csv(source_path, rows, directory):
+    """Scale a shipped CSV to the requested row count under a new university name"""
+    base = pd.read_csv(source_path, dtype=str, encoding='utf-8-sig', encoding_errors='replace')
+    repeats = int(np.ceil(rows / len(base)))
+    df = pd.concat([base] * repeats, ignore_index=True).iloc[:rows].copy()
+    name = f"Synthetic University {rows}"
+    df['rec_id'] = [str(i + 1) for i in range(rows)]
+    df['uni_name'] = name
+    # Every row goes into the default department and has unique content,
+    # so the whole file is embedded and the embedding cache can't shortcut it
+    df['dept_id'] = '0'
+    df['rec_content'] = df['rec_content'].fillna('') + [f" (variant {i})" for i in range(rows)]
+    path = os.path.join(directory, f"synthetic_{rows}.csv")
+    df.to_csv(path, index=False)
+    return name, path
+
+
+def bench_preload(app):
+    app.registry.clear()
+    start = time.perf_counter()
+    app.preload_csv_files()
+    elapsed = time.perf_counter() - start
+    rows = sum(app.registry.entry(name).document_count for name in app.registry.names())
+    return {'universities': len(app.registry), 'rows': rows, 'seconds': round(elapsed, 4),
+            'rows_per_second': round(rows / elapsed, 1) if elapsed else None}
+
+
+def bench_upload(app, path, university_name):
+    client = app.app.test_client()
+    if university_name in app.registry:
+        client.delete(f"/api/universities/{university_name}")
+    with open(path, 'rb') as f:
+        payload = f.read()
+    start = time.perf_counter()
+    response = client.post('/api/universities/upload', data={'file': (io.BytesIO(payload), os.path.basename(path))},
+                           content_type='multipart/form-data')
+    elapsed = time.perf_counter() - start
+    rows = app.registry.entry(university_name).document_count if university_name in app.registry else 0
+    return {'university': university_name, 'status_code': response.status_code, 'bytes': len(payload), 'rows': rows,
+            'seconds': round(elapsed, 4), 'rows_per_second': round(rows / elapsed, 1) if elapsed else None}
+
+
+def bench_collection(app, university_name):
+    before = dict(fake_genai.settings.calls)
+    start = time.perf_counter()
+    db = app.get_or_create_collection(BENCH_API_KEY, university_name)
+    elapsed = time.perf_counter() - start
+    count = db.count()
+    if count:
+        app.set_index_status(university_name, app.INDEX_READY)
+    calls = {key: fake_genai.settings.calls[key] - before[key] for key in before}
+    return {'university': university_name, 'documents': count, 'seconds': round(elapsed, 4),
+            'documents_per_second': round(count / elapsed, 1) if elapsed else None,
+            'embed_calls': calls['embed_content'], 'embedded_items': calls['embedded_items']}
+
+
+def build_questions(args, universities):
+    questions = []
+    for i in range(args.requests):
+        question = SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]
+        # Unique suffixes defeat the answer cache for the non-repeated share
+        if (i % 100) >= args.repeat_ratio * 100:
+            question = f"{question} (request {i})"
+        payload = {'query': question, 'api_key': BENCH_API_KEY, 'university_name': universities[i % len(universities)]}
+        if args.retrieval_mode:
+            payload['retrieval_mode'] = args.retrieval_mode
+        questions.append(payload)
+    return questions
+
+
+def load_test_flask(app, args, questions):
+    def send(payload):
+        client = app.app.test_client()
+        start = time.perf_counter()
+        response = client.post(args.endpoint, json=payload)
+        response.get_data()
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(send, questions))
+    wall = time.perf_counter() - start
+    summary = summarize_latencies([latency for latency, _ in results], wall)
+    summary['non_200'] = sum(1 for _, status in results if status != 200)
+    return summary
+
+
+def load_test_asgi(args, questions):
+    import httpx
+    import asgi
+
+    async def run():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            async def send(payload):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post(args.endpoint, json=payload)
+                    return time.perf_counter() - start, response.status_code
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(send(payload) for payload in questions))
+            return results, time.perf_counter() - start
+
+    results, wall = asyncio.run(run())
+    summary = summarize_latencies([latency for latency, _ in results], wall)
+    summary['non_200'] = sum(1 for _, status in results if status != 200)
+    return summary
+
+
+def print_section(title, rows):
+    print(f"\n== {title} ==")
+    for row in rows if isinstance(rows, list) else [rows]:
+        print('  ' + ', '.join(f"{key}={value}" for key, value in row.items()))
+
+
+def main():
+    args = parse_args()
+    work_dir = tempfile.mkdtemp(prefix='chatbot-bench-')
+
+    # Isolate the benchmark from any real vector store, cache or server key
+    os.environ['CHROMA_PERSIST_DIR'] = os.path.join(work_dir, 'chroma_db')
+    os.environ['UPLOAD_DIR'] = os.path.join(work_dir, 'uploads')
+    os.environ.pop('GOOGLE_API_KEY', None)
+    os.environ.pop('GEMINI_API_KEY', None)
+    # The fake client has no quota, so time the build rather than the rate limiter
+    for limit in ('GENERATE_RPM', 'GENERATE_TPM', 'EMBED_RPM', 'EMBED_TPM'):
+        os.environ[limit] = '0'
+    fake_genai.install(fake_genai.FakeSettings(
+        embed_latency=args.embed_latency,
+        embed_latency_per_item=args.embed_latency_per_item,
+        generate_latency=args.generate_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    ))
+
+    start = time.perf_counter()
+    import app
+    results = {'import_seconds': round(time.perf_counter() - start, 4)}
+    print(f"Working directory: {work_dir}")
+    print(f"Imported app (includes startup preload) in {results['import_seconds']}s")
+
+    results['preload'] = bench_preload(app)
+    print_section('preload_csv_files', results['preload'])
+
+    data_dir = os.path.join(REPO_DIR, 'data')
+    csv_paths = sorted(
+        os.path.join(data_dir, name) for name in os.listdir(data_dir)
+        if name.endswith('.csv')
+    )
+
+    # Re-upload each shipped file in place of its preloaded copy
+    uploads = [bench_upload(app, path, csv_university_name(path)) for path in csv_paths]
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    synthetic = []
+    for rows in scales:
+        name, path = make_synthetic_csv(csv_paths[0], rows, work_dir)
+        synthetic.append(name)
+        uploads.append(bench_upload(app, path, name))
+    results['upload'] = uploads
+    print_section('upload_university', uploads)
+
+    collections = [bench_collection(app, name) for name in app.registry.names() if name not in synthetic]
+    if not args.skip_collections:
+        collections += [bench_collection(app, name) for name in synthetic]
+    results['collections'] = collections
+    print_section('get_or_create_collection', collections)
+
+    shipped_names = [name for name in app.registry.names() if name not in synthetic]
+    questions = build_questions(args, shipped_names)
+    results['load'] = {}
+    if args.server in ('flask', 'both'):
+        results['load']['flask'] = load_test_flask(app, args, questions)
+        print_section(f'Flask {args.endpoint} load (concurrency {args.concurrency})', results['load']['flask'])
+    if args.server in ('asgi', 'both'):
+        for name in shipped_names:
+            app.answer_cache.invalidate_university(name)
+        results['load']['asgi'] = load_test_asgi(args, questions)
+        print_section(f'ASGI {args.endpoint} load (concurrency {args.concurrency})', results['load']['asgi'])
+
+    results['fake_api_calls'] = dict(fake_genai.settings.calls)
+    print_section('Fake Gemini calls', results['fake_api_calls'])
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json_path}")
+
+
+def csv_university_name(path):
+    """Read the university name a CSV will be registered under"""
+    df, _ = ingestion.read_university_csv(path)
+    return ingestion.get_university_name(df)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# caches.py
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Normalize a question so trivially different phrasings share a cache entry"""
+    text = re.sub(r'\s+', ' ', str(text).strip().lower())
+    return text.rstrip('?!. ')
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def remove_where(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class AnswerCache:
+    """Answer cache keyed by (university_name, prompt variant, normalized query).
+
+    With a similarity threshold set, a miss on the exact key can still be
+    served by a cached answer whose question embedding is close enough.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, similarity_threshold=None):
+        self.similarity_threshold = similarity_threshold
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        # (university_name, prompt variant) -> {normalized query: unit-length embedding}
+        self._embeddings = {}
+        self._lock = threading.Lock()
+
+    def get(self, university_name, prompt_variant, query):
+        """Look up an answer by its exact normalized question"""
+        return self._entries.get((university_name, prompt_variant, normalize_query(query)))
+
+    def get_similar(self, university_name, prompt_variant, query_embedding):
+        """Look up the cached answer whose question is most similar, above the threshold"""
+        if not self.similarity_threshold or query_embedding is None:
+            return None
+
+        with self._lock:
+            candidates = list(self._embeddings.get((university_name, prompt_variant), {}).items())
+        if not candidates:
+            return None
+
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        scores = np.stack([embedding for _, embedding in candidates]) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return self._entries.get((university_name, prompt_variant, candidates[best][0]))
+
+    def put(self, university_name, prompt_variant, query, value, query_embedding=None):
+        normalized = normalize_query(query)
+        self._entries.put((university_name, prompt_variant, normalized), value)
+
+        if self.similarity_threshold and query_embedding is not None:
+            vector = np.asarray(query_embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            with self._lock:
+                variants = self._embeddings.setdefault((university_name, prompt_variant), {})
+                variants[normalized] = vector
+                # Expired or evicted answers leave stale embeddings behind; keep them bounded
+                if len(variants) > self._entries.maxsize:
+                    variants.pop(next(iter(variants)))
+
+    def invalidate_university(self, university_name):
+        """Forget every cached answer for a university, including multi-university answers it is part of"""
+        def covers(key):
+            return key[0] == university_name or (isinstance(key[0], tuple) and university_name in key[0])
+
+        self._entries.remove_where(covers)
+        with self._lock:
+            for key in [key for key in self._embeddings if covers(key)]:
+                del self._embeddings[key]
@@ -0,0 +1,116 @@
+# context_builder.py
+"""Assemble the retrieved passages that go into a prompt.
+
+Candidates are cut to an adaptive depth based on their score distribution,
+near-duplicates are dropped, the rest are reranked with maximal marginal
+relevance (MMR) and added until a token budget is spent.
+"""
+import re
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Rough characters-per-token ratio for English text with Gemini tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Approximate the token count of text without calling the tokenizer"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class BuiltContext:
+    """The passages chosen for a prompt and the rows they came from"""
+
+    def __init__(self, passages):
+        self.passages = passages
+
+    @property
+    def documents(self):
+        return [passage['document'] for passage in self.passages]
+
+    @property
+    def metadatas(self):
+        return [passage['metadata'] for passage in self.passages]
+
+    @property
+    def token_count(self):
+        return sum(estimate_tokens(passage['document']) for passage in self.passages)
+
+
+def _word_set(text):
+    return frozenset(WORD_PATTERN.findall(text.lower()))
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def build_context(candidates, token_budget=3000, max_passages=15, min_passages=3,
+                  score_margin=0.5, duplicate_threshold=0.9, mmr_lambda=0.7):
+    """Choose passages from scored candidates.
+
+    Each candidate is a dict with id, document, metadata, score (higher is more
+    relevant) and optionally embedding. Candidates must arrive best first.
+    """
+    candidates = [c for c in candidates if c['document'] and c['document'].strip()]
+    if not candidates:
+        return BuiltContext([])
+
+    # Adaptive depth: keep candidates in the upper part of the score range,
+    # so a sharp head yields a short context and a flat tail a longer one
+    scores = np.asarray([c['score'] for c in candidates], dtype=np.float64)
+    cutoff = scores.max() - score_margin * (scores.max() - scores.min())
+    depth = max(min_passages, int(np.count_nonzero(scores >= cutoff)))
+    candidates = candidates[:depth]
+    scores = scores[:depth]
+
+    words = [_word_set(c['document']) for c in candidates]
+    embeddings = [_unit(c['embedding']) if c.get('embedding') is not None else None for c in candidates]
+
+    def similarity(i, j):
+        if embeddings[i] is not None and embeddings[j] is not None:
+            return float(embeddings[i] @ embeddings[j])
+        return _jaccard(words[i], words[j])
+
+    # Scale relevance to [0, 1] so it is comparable with passage similarity in MMR
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread else np.ones_like(scores)
+
+    selected = []
+    max_similarity = np.zeros(len(candidates))
+    remaining = set(range(len(candidates)))
+    budget = token_budget
+
+    while remaining and len(selected) < max_passages:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max_similarity[i])
+        remaining.discard(best)
+
+        # Near-duplicates of an already chosen passage add nothing but tokens
+        if max_similarity[best] >= duplicate_threshold:
+            continue
+
+        passage = dict(candidates[best])
+        cost = estimate_tokens(passage['document'])
+        if cost > budget:
+            if selected:
+                break
+            # Always keep the best passage, trimmed to fit
+            passage['document'] = passage['document'][:budget * CHARS_PER_TOKEN]
+            cost = budget
+        budget -= cost
+        selected.append(passage)
+
+        for i in remaining:
+            max_similarity[i] = max(max_similarity[i], similarity(i, best))
+
+    return BuiltContext(selected)
@@ -0,0 +1,158 @@
+# ingestion.py
+"""Shared CSV ingestion for preloaded and uploaded university exports.
+
+The encoding is detected once from a byte sample instead of re-parsing the
+whole file per candidate encoding, files are parsed with their header row
+as all-string columns, and index rows are built column-wise.
+"""
+import codecs
+import csv
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - pyarrow is in requirements.txt
+    pa = pa_csv = None
+
+logger = logging.getLogger(__name__)
+
+EXPECTED_COLUMNS = ['rec_id','uni_id', 'uni_name', 'dept_id', 'dept_name','description','rec_url','date_created','date_modified', 'user_rating', 'tags', 'rec_content']
+
+# Tried in order; latin-1 decodes any byte sequence so it is the last resort
+ENCODINGS = ['utf-8-sig', 'cp1252', 'latin-1']
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
+# pyarrow parses multi-threaded when installed; pandas' C engine is the fallback
+CSV_ENGINE = 'pyarrow' if pa_csv is not None else 'c'
+
+# Files above this size are parsed in chunks to bound parser memory
+CHUNKED_READ_BYTES = int(os.environ.get('CHUNKED_READ_BYTES', 16 * 1024 * 1024))
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 50000))
+
+DEFAULT_DEPARTMENT_ID = '0'
+
+
+def detect_encoding(path, sample_bytes=ENCODING_SAMPLE_BYTES):
+    """Pick the first supported encoding that decodes a sample of the file"""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    for encoding in ENCODINGS:
+        try:
+            # An incremental decoder tolerates a multi-byte character cut off at the sample end
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return ENCODINGS[-1]
+
+
+def _read_arrow(path, encoding):
+    # pandas' pyarrow engine infers types before applying dtype=str, turning '007' into
+    # '7.0' and empty cells into 'nan', so every column is read as a string here instead
+    with open(path, newline='', encoding=encoding) as f:
+        header = next(csv.reader(f), [])
+    table = pa_csv.read_csv(
+        path,
+        read_options=pa_csv.ReadOptions(encoding=encoding),
+        # Quoted content often spans lines
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in header},
+                                              strings_can_be_null=True, quoted_strings_can_be_null=False),
+    )
+    return table.to_pandas()
+
+
+def _read(path, encoding, chunked):
+    if not chunked and CSV_ENGINE == 'pyarrow':
+        return _read_arrow(path, encoding)
+    options = {'header': 0, 'dtype': str, 'encoding': encoding}
+    if not chunked:
+        return pd.read_csv(path, engine='c', **options)
+    # pyarrow does not support chunked reads
+    chunks = pd.read_csv(path, engine='c', chunksize=CSV_CHUNK_ROWS, **options)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_university_csv(path):
+    """Read a university export, returning (DataFrame, encoding)"""
+    chunked = os.path.getsize(path) > CHUNKED_READ_BYTES
+    encoding = detect_encoding(path)
+    candidates = ENCODINGS[ENCODINGS.index(encoding):]
+    for candidate in candidates:
+        try:
+            df = _read(path, candidate, chunked)
+            df.columns = [str(column).strip() for column in df.columns]
+            return df, candidate
+        except UnicodeDecodeError:
+            # The sample decoded but a later part of the file did not
+            logger.info(f"{path} is not valid {candidate} past the sampled bytes, retrying")
+            continue
+    raise ValueError(f"Could not decode {path}")
+
+
+def validate_csv_structure(df):
+    """Validate that uploaded CSV has the correct structure"""
+    if df.empty:
+        return False, "CSV file is empty"
+
+    # Check if all expected columns are present
+    missing_columns = set(EXPECTED_COLUMNS) - set(df.columns)
+    if missing_columns:
+        return False, f"Missing required columns: {', '.join(missing_columns)}"
+
+    # Check if required fields have data
+    if df['uni_name'].isna().all():
+        return False, "University name column is empty"
+
+    if df['rec_content'].isna().all():
+        return False, "Content column is empty"
+
+    return True, "Valid CSV structure"
+
+
+def get_university_name(df):
+    """Return the first non-empty uni_name in the export"""
+    names = df['uni_name'].dropna().str.strip()
+    names = names[names != '']
+    return names.iloc[0] if not names.empty else "Unknown University"
+
+
+def build_rows(df, university_name, department_id=DEFAULT_DEPARTMENT_ID):
+    """Build the (documents, metadatas, ids) indexed for one department of an export"""
+    dept_data = df.loc[df['dept_id'].str.strip() == department_id]
+
+    documents = dept_data['rec_content'].fillna('').tolist()
+    metadatas = [
+        {'rec_url': url, 'rec_id': rec_id, 'description': description}
+        for url, rec_id, description in zip(
+            dept_data['rec_url'].fillna('').tolist(),
+            dept_data['rec_id'].fillna('').tolist(),
+            dept_data['description'].fillna('').tolist()
+        )
+    ]
+    return documents, metadatas, build_ids(university_name, [metadata['rec_id'] for metadata in metadatas])
+
+
+def build_ids(university_name, rec_ids):
+    """Derive stable row ids from rec_id so re-uploads update rows in place"""
+    ids = []
+    seen = {}
+    for i, rec_id in enumerate(rec_ids):
+        key = str(rec_id).strip() or f"row{i}"
+        # Repeated rec_ids get an occurrence suffix to stay unique
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(f"{university_name}_{key}" if occurrence == 0 else f"{university_name}_{key}#{occurrence}")
+    return ids
+
+
+def row_hash(document, metadata):
+    """Hash a row's indexed content, to tell which rows changed between uploads"""
+    payload = json.dumps([document, metadata], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,94 @@
+# lexical_index.py
+import re
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Very common words carry no signal for sitemap passages
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or our
+that the this to was we what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase text and split it into indexable terms"""
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+
+class LexicalIndex:
+    """In-process BM25 index over one university's passages.
+
+    Postings are stored CSR-style (term offsets into flat doc/weight arrays)
+    with the full BM25 weight precomputed per posting, so a query is a few
+    array slices and one bincount with no network access.
+    """
+
+    def __init__(self, ids, documents, metadatas, k1=1.5, b=0.75):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+
+        # Index the passage together with its page description
+        token_lists = [
+            tokenize(f"{document} {(metadata or {}).get('description', '')}")
+            for document, metadata in zip(self.documents, self.metadatas)
+        ]
+
+        vocabulary = {}
+        term_ids = []
+        doc_ids = []
+        for doc_id, tokens in enumerate(token_lists):
+            for token in tokens:
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(doc_id)
+        self.vocabulary = vocabulary
+
+        num_docs = len(token_lists)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+
+        # Collapse (term, doc) pairs into term frequencies, sorted by term
+        pair_keys, tf = np.unique(term_ids * max(num_docs, 1) + doc_ids, return_counts=True)
+        posting_terms = pair_keys // max(num_docs, 1)
+        self.posting_docs = pair_keys % max(num_docs, 1)
+        self.term_offsets = np.searchsorted(posting_terms, np.arange(len(vocabulary) + 1))
+
+        doc_lengths = np.asarray([len(tokens) for tokens in token_lists], dtype=np.float64)
+        avg_length = doc_lengths.mean() if num_docs and doc_lengths.mean() > 0 else 1.0
+        doc_freq = np.diff(self.term_offsets)
+        idf = np.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        norm = k1 * (1 - b + b * doc_lengths[self.posting_docs] / avg_length)
+        self.posting_weights = idf[posting_terms] * tf * (k1 + 1) / (tf + norm)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, n_results=15):
+        """Return (positions, scores) of the best matching passages, best first"""
+        term_ids = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not term_ids or not self.ids:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        slices = [slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.posting_docs[s] for s in slices])
+        weights = np.concatenate([self.posting_weights[s] for s in slices])
+        scores = np.bincount(docs, weights=weights, minlength=len(self.ids))
+
+        n_results = min(n_results, int(np.count_nonzero(scores)))
+        if n_results == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked id lists into (id, score) pairs ordered by summed 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,274 @@
+# metrics.py
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Metrics are per process; under gunicorn each worker reports its own values.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Set LOG_REQUEST_METRICS=1 to emit one structured log line per request
+LOG_REQUEST_METRICS = os.environ.get('LOG_REQUEST_METRICS', '').lower() in ('1', 'true', 'yes')
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'chatbot_stage_seconds', 'Latency of each /ask pipeline stage', ['stage'])
+REQUEST_SECONDS = Histogram(
+    'chatbot_request_seconds', 'End-to-end latency of question answering requests', ['route'])
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    'chatbot_time_to_first_token_seconds', 'Time from request start to the first streamed token', ['route'])
+PROMPT_CHARACTERS = Histogram(
+    'chatbot_prompt_characters', 'Size of prompts sent for generation', buckets=SIZE_BUCKETS)
+TOKENS = Counter(
+    'chatbot_tokens_total', 'Gemini tokens reported by usage metadata', ['kind'])
+CHARACTERS = Counter(
+    'chatbot_characters_total', 'Characters sent to and received from Gemini', ['kind'])
+CACHE_REQUESTS = Counter(
+    'chatbot_cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+COALESCED_CALLS = Counter(
+    'chatbot_coalesced_calls_total', 'Calls that shared an identical in-flight call instead of repeating it', ['flight'])
+SCHEDULER_REJECTED = Counter(
+    'chatbot_scheduler_rejected_total', 'Gemini calls answered as busy after queueing past their deadline', ['resource'])
+REGISTRY_EVICTIONS = Counter(
+    'chatbot_registry_evictions_total', 'Universities unloaded from memory to stay within the memory budget')
+REGISTRY_RELOADS = Counter(
+    'chatbot_registry_reloads_total', 'Evicted universities reloaded from their source CSV')
+REGISTRY_RESIDENT_BYTES = Gauge(
+    'chatbot_registry_resident_bytes', 'Estimated memory held by loaded university data and lexical indexes')
+
+ALL_METRICS = [STAGE_SECONDS, REQUEST_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS, PROMPT_CHARACTERS, TOKENS, CHARACTERS, CACHE_REQUESTS,
+               COALESCED_CALLS, SCHEDULER_REJECTED, REGISTRY_EVICTIONS, REGISTRY_RELOADS, REGISTRY_RESIDENT_BYTES]
+
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def render_metrics():
+    """Render every metric in Prometheus text exposition format"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def start_trace(route):
+    """Start collecting per-stage timings for the current request"""
+    trace = {'route': route, 'start': time.perf_counter(), 'stages': {}, 'fields': {}}
+    _current_trace.set(trace)
+    return trace
+
+
+def annotate(**fields):
+    """Attach fields to the current request's structured log line"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace['fields'].update(fields)
+
+
+def finish_trace():
+    """Record the current request's total latency and optionally log its trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    _current_trace.set(None)
+    duration = time.perf_counter() - trace['start']
+    REQUEST_SECONDS.observe(duration, route=trace['route'])
+    if LOG_REQUEST_METRICS:
+        logger.info(json.dumps({
+            'event': 'request_metrics',
+            'route': trace['route'],
+            'duration_ms': round(duration * 1000, 2),
+            'stages_ms': {stage: round(seconds * 1000, 2) for stage, seconds in trace['stages'].items()},
+            **trace['fields'],
+        }))
+
+
+def traced(route):
+    """Decorate a request handler or streaming generator so it records a request trace"""
+    def decorator(handler):
+        # Streaming handlers are generators; their trace spans the whole stream
+        if inspect.isgeneratorfunction(handler):
+            @functools.wraps(handler)
+            def generator_wrapper(*args, **kwargs):
+                start_trace(route)
+                try:
+                    yield from handler(*args, **kwargs)
+                finally:
+                    finish_trace()
+            return generator_wrapper
+
+        if inspect.isasyncgenfunction(handler):
+            @functools.wraps(handler)
+            async def async_generator_wrapper(*args, **kwargs):
+                start_trace(route)
+                try:
+                    async for item in handler(*args, **kwargs):
+                        yield item
+                finally:
+                    finish_trace()
+            return async_generator_wrapper
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                start_trace(route)
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    finish_trace()
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start_trace(route)
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                finish_trace()
+        return wrapper
+    return decorator
+
+
+def mark_first_token():
+    """Record time to first token for a streaming request, once"""
+    trace = _current_trace.get()
+    if trace is not None and 'first_token_ms' not in trace['fields']:
+        elapsed = time.perf_counter() - trace['start']
+        trace['fields']['first_token_ms'] = round(elapsed * 1000, 2)
+        TIME_TO_FIRST_TOKEN_SECONDS.observe(elapsed, route=trace['route'])
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+    annotate(**{f'{cache}_cache': 'hit' if hit else 'miss'})
+
+
+def record_generation(prompt, answer_text, usage_metadata=None):
+    """Record prompt/answer sizes and token usage for one generation"""
+    PROMPT_CHARACTERS.observe(len(prompt))
+    CHARACTERS.inc(len(prompt), kind='prompt')
+    CHARACTERS.inc(len(answer_text or ''), kind='output')
+    fields = {'prompt_chars': len(prompt), 'answer_chars': len(answer_text or '')}
+    if usage_metadata is not None:
+        prompt_tokens = getattr(usage_metadata, 'prompt_token_count', None) or 0
+        output_tokens = getattr(usage_metadata, 'candidates_token_count', None) or 0
+        TOKENS.inc(prompt_tokens, kind='prompt')
+        TOKENS.inc(output_tokens, kind='output')
+        fields.update(prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+    annotate(**fields)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a pipeline stage into the stage histogram and the current request trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace['stages'][stage] = trace['stages'].get(stage, 0.0) + elapsed
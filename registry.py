@@ -0,0 +1,184 @@
+# registry.py
+"""Loaded universities, kept within a memory budget.
+
+Each university keeps only the columns the app reads, stored compactly,
+plus its BM25 index. When the total goes over budget the least recently
+queried universities are unloaded; they stay listed and are reloaded from
+their source CSV the next time they are needed.
+"""
+import importlib.util
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from ingestion import build_rows, read_university_csv
+from lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+# Columns read after ingestion; everything else in an export is dropped
+STORED_COLUMNS = ['rec_id', 'dept_id', 'description', 'rec_url', 'rec_content']
+
+# Arrow-backed strings avoid one Python object per cell when pyarrow is installed
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') else object
+
+
+def compact_frame(df):
+    """Keep the stored columns, with repetitive ones as categoricals"""
+    df = df[STORED_COLUMNS].copy()
+    for column in STORED_COLUMNS:
+        df[column] = df[column].astype('category' if column == 'dept_id' else STRING_DTYPE)
+    return df
+
+
+def source_version(path):
+    """Modification time of a source CSV in nanoseconds, or 0 if it is missing"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+class UniversityEntry:
+    def __init__(self, name, source_path, document_count):
+        self.name = name
+        self.source_path = source_path
+        self.document_count = document_count
+        # Orders uploads across workers; see shared_index
+        self.source_version = source_version(source_path)
+        self.data = None
+        self.lexical_index = None
+        self.nbytes = 0
+        self.collection_loaded = False
+        self.lock = threading.Lock()
+
+    @property
+    def resident(self):
+        return self.data is not None
+
+
+class UniversityRegistry:
+    """Universities by name, in least to most recently used order"""
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def entry(self, name):
+        with self._lock:
+            return self._entries.get(name)
+
+    def add(self, name, df, source_path):
+        """Register a university from an ingested DataFrame, replacing any earlier entry"""
+        entry = UniversityEntry(name, source_path, len(df))
+        self._populate(entry, df)
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = entry
+        self._enforce_budget()
+        return entry
+
+    def remove(self, name):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            self._enforce_budget()
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._enforce_budget()
+
+    def touch(self, name):
+        """Mark a university as just queried"""
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+
+    def get_lexical_index(self, name):
+        """Return a university's BM25 index, reloading it if it was evicted"""
+        return self.snapshot(name)[2]
+
+    def is_collection_loaded(self, name):
+        entry = self.entry(name)
+        return entry is not None and entry.collection_loaded
+
+    def mark_collection_loaded(self, entry):
+        """Mark the entry whose rows were indexed; a replacement uploaded meanwhile stays unloaded"""
+        entry.collection_loaded = True
+
+    def snapshot(self, name):
+        """Return (entry, data, lexical_index) for a university, reloading it if it was evicted.
+
+        The three are read together under the entry's lock, so a concurrent
+        eviction can't leave the caller holding a half-unloaded entry.
+        """
+        entry = self.entry(name)
+        if entry is None:
+            return None, None, None
+        self.touch(name)
+
+        with entry.lock:
+            if not entry.resident:
+                logger.info(f"Reloading evicted university {name} from {entry.source_path}")
+                entry.source_version = source_version(entry.source_path)
+                df, _ = read_university_csv(entry.source_path)
+                self._populate(entry, df)
+                metrics.REGISTRY_RELOADS.inc()
+            data, lexical_index = entry.data, entry.lexical_index
+        self._enforce_budget(keep=name)
+        return entry, data, lexical_index
+
+    def _populate(self, entry, df):
+        data = compact_frame(df)
+        try:
+            documents, metadatas, ids = build_rows(data, entry.name)
+            lexical_index = LexicalIndex(ids, documents, metadatas)
+            logger.info(f"Built lexical index for {entry.name} with {len(ids)} passages")
+        except Exception as e:
+            logger.error(f"Error building lexical index for {entry.name}: {e}")
+            lexical_index = None
+
+        nbytes = int(data.memory_usage(deep=True).sum())
+        if lexical_index is not None:
+            nbytes += sum(array.nbytes for array in (
+                lexical_index.posting_docs, lexical_index.posting_weights, lexical_index.term_offsets))
+            nbytes += sum(len(document) for document in lexical_index.documents)
+        entry.data, entry.lexical_index, entry.nbytes = data, lexical_index, nbytes
+
+    def _enforce_budget(self, keep=None):
+        """Unload least recently used universities until resident data fits the budget"""
+        with self._lock:
+            total = sum(entry.nbytes for entry in self._entries.values())
+            for name, entry in list(self._entries.items()):
+                if total <= self.memory_budget_bytes:
+                    break
+                # The most recently used university always stays resident
+                if name == keep or name == next(reversed(self._entries)) or not entry.resident:
+                    continue
+                # An entry being reloaded or read right now is skipped rather than waited on
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    total -= entry.nbytes
+                    entry.data, entry.lexical_index, entry.nbytes = None, None, 0
+                finally:
+                    entry.lock.release()
+                metrics.REGISTRY_EVICTIONS.inc()
+                logger.info(f"Evicted {name} from memory ({total} of {self.memory_budget_bytes} bytes resident)")
+            metrics.REGISTRY_RESIDENT_BYTES.set(total)
@@ -0,0 +1,237 @@
+# scheduler.py
+"""Per-API-key scheduling for Gemini calls.
+
+Each (API key, resource) pair has token buckets for requests and tokens per
+minute and an adaptive concurrency limit that halves on 429/503 responses
+and grows back by one slot per window of successful calls (AIMD). Callers
+queue by priority, so interactive questions go ahead of bulk indexing, and
+give up with BusyError once their deadline passes instead of hanging.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Async waiters poll at this interval while blocked on concurrency
+ASYNC_POLL_SECONDS = 0.02
+
+# Concurrent throttling responses within this window count as one signal
+BACKOFF_WINDOW_SECONDS = 1.0
+
+
+class BusyError(Exception):
+    """A call could not start before its deadline"""
+
+
+def is_throttling_error(e):
+    return getattr(e, 'code', None) in (429, 503)
+
+
+class TokenBucket:
+    """Continuously refilling per-minute budget; a limit of 0 disables it"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (0 if it is now)"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # A single request larger than the bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def take(self, amount):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'deadline', 'sequence', 'requests', 'tokens')
+
+    def __init__(self, priority, deadline, sequence, requests, tokens):
+        self.priority = priority
+        self.deadline = deadline
+        self.sequence = sequence
+        self.requests = requests
+        self.tokens = tokens
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class _Limiter:
+    """Buckets, concurrency and the wait queue for one API key and resource"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency, min_concurrency):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.queue = []
+        self.last_backoff = 0.0
+        self.condition = threading.Condition()
+
+    @property
+    def idle(self):
+        return self.in_flight == 0 and not self.queue
+
+    def try_acquire(self, waiter):
+        """Start the call if it is at the head of the queue and within limits; else return a wait hint"""
+        if self.queue[0] is not waiter:
+            return False, None
+        if self.in_flight >= int(self.concurrency_limit):
+            return False, None
+        now = time.monotonic()
+        wait = max(self.requests.wait_time(waiter.requests, now), self.tokens.wait_time(waiter.tokens, now))
+        if wait > 0:
+            return False, wait
+        self.requests.take(waiter.requests)
+        self.tokens.take(waiter.tokens)
+        heapq.heappop(self.queue)
+        self.in_flight += 1
+        # The next waiter is now at the head and may be able to start too
+        self.condition.notify_all()
+        return True, None
+
+    def release(self, throttled):
+        self.in_flight -= 1
+        now = time.monotonic()
+        if throttled:
+            if now - self.last_backoff >= BACKOFF_WINDOW_SECONDS:
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                self.last_backoff = now
+        else:
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+        self.condition.notify_all()
+
+
+class Scheduler:
+    """Rate-aware admission for Gemini calls, keyed by API key and resource"""
+
+    def __init__(self, limits, max_concurrency=8, min_concurrency=1, max_keys=1024):
+        # resource -> (requests per minute, tokens per minute)
+        self.limits = limits
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_keys = max_keys
+        self._limiters = OrderedDict()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _limiter(self, api_key, resource):
+        key = (api_key, resource)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                requests_per_minute, tokens_per_minute = self.limits.get(resource, (0, 0))
+                limiter = _Limiter(requests_per_minute, tokens_per_minute, self.max_concurrency, self.min_concurrency)
+                self._limiters[key] = limiter
+                # Forget the least recently used keys that have nothing in flight
+                for old_key in list(self._limiters)[:max(0, len(self._limiters) - self.max_keys)]:
+                    if self._limiters[old_key].idle:
+                        del self._limiters[old_key]
+            else:
+                self._limiters.move_to_end(key)
+            return limiter
+
+    def concurrency_limit(self, api_key, resource):
+        return int(self._limiter(api_key, resource).concurrency_limit)
+
+    def _enqueue(self, limiter, priority, timeout, requests, tokens):
+        waiter = _Waiter(priority, time.monotonic() + timeout, next(self._sequence), requests, tokens)
+        heapq.heappush(limiter.queue, waiter)
+        return waiter
+
+    def _give_up(self, limiter, waiter, resource):
+        limiter.queue.remove(waiter)
+        heapq.heapify(limiter.queue)
+        limiter.condition.notify_all()
+        metrics.SCHEDULER_REJECTED.inc(resource=resource)
+        raise BusyError(f"Too many {resource} requests are queued for this API key")
+
+    def acquire(self, api_key, resource, priority=PRIORITY_INTERACTIVE, requests=1, tokens=0, timeout=30.0):
+        """Block until the call may start; raise BusyError once timeout seconds pass"""
+        limiter = self._limiter(api_key, resource)
+        with metrics.stage_timer(f'{resource}_queue'), limiter.condition:
+            waiter = self._enqueue(limiter, priority, timeout, requests, tokens)
+            while True:
+                acquired, wait = limiter.try_acquire(waiter)
+                if acquired:
+                    return limiter
+                remaining = waiter.deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(limiter, waiter, resource)
+                limiter.condition.wait(min(remaining, wait) if wait else remaining)
+
+    async def acquire_async(self, api_key, resource, priority=PRIORITY_INTERACTIVE, requests=1, tokens=0, timeout=30.0):
+        """Async counterpart of acquire that waits without blocking the event loop"""
+        limiter = self._limiter(api_key, resource)
+        with metrics.stage_timer(f'{resource}_queue'):
+            with limiter.condition:
+                waiter = self._enqueue(limiter, priority, timeout, requests, tokens)
+            try:
+                while True:
+                    with limiter.condition:
+                        acquired, wait = limiter.try_acquire(waiter)
+                        if acquired:
+                            return limiter
+                        remaining = waiter.deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._give_up(limiter, waiter, resource)
+                    await asyncio.sleep(min(remaining, wait or ASYNC_POLL_SECONDS))
+            except asyncio.CancelledError:
+                with limiter.condition:
+                    if waiter in limiter.queue:
+                        limiter.queue.remove(waiter)
+                        heapq.heapify(limiter.queue)
+                        limiter.condition.notify_all()
+                raise
+
+    def release(self, limiter, throttled=False):
+        with limiter.condition:
+            limiter.release(throttled)
+
+    @contextmanager
+    def slot(self, api_key, resource, priority=PRIORITY_INTERACTIVE, requests=1, tokens=0, timeout=30.0):
+        """Hold a call slot for the body; a 429/503 raised inside backs off the key's concurrency"""
+        limiter = self.acquire(api_key, resource, priority, requests, tokens, timeout)
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise
+        finally:
+            self.release(limiter, throttled)
+
+    @asynccontextmanager
+    async def async_slot(self, api_key, resource, priority=PRIORITY_INTERACTIVE, requests=1, tokens=0, timeout=30.0):
+        limiter = await self.acquire_async(api_key, resource, priority, requests, tokens, timeout)
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise
+        finally:
+            self.release(limiter, throttled)
@@ -0,0 +1,207 @@
+# shared_index.py
+"""Read-only vector indexes shared between worker processes.
+
+Each university's index is a versioned directory holding a float32 NumPy
+matrix of unit-length embeddings plus a row sidecar (one JSON record per
+row addressed through an offsets array). Workers map both files read-only,
+so gunicorn workers on one box share the same page cache instead of each
+holding its own vector store. A build runs once under a file lock and is
+published by atomically replacing a CURRENT pointer file; readers pick up
+the new version on their next lookup.
+
+Each version records the source version (modification time) of the CSV it
+was built from, and a build never publishes older data over a newer
+version. A worker whose loaded data is stale therefore adopts the newer
+index instead of reverting it.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized between processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+POINTER_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+ROWS_FILE = 'rows.bin'
+OFFSETS_FILE = 'offsets.npy'
+
+
+def rows_fingerprint(documents, metadatas, ids):
+    """Hash the rows an index is built from, to tell whether it is current"""
+    digest = hashlib.sha256()
+    for row in zip(ids, documents, metadatas):
+        digest.update(json.dumps(row, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class SharedIndex:
+    """One published version of a university's index, with a Chroma-like query interface"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode='r')
+        self.rows = np.memmap(os.path.join(path, ROWS_FILE), dtype=np.uint8, mode='r') if self.offsets[-1] else b''
+
+    @property
+    def fingerprint(self):
+        return self.manifest['fingerprint']
+
+    @property
+    def source_version(self):
+        return self.manifest.get('source_version', 0)
+
+    def count(self):
+        return int(self.embeddings.shape[0])
+
+    def row(self, i):
+        """Return (id, document, metadata) for row i"""
+        return tuple(json.loads(bytes(self.rows[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')))
+
+    def query(self, query_embeddings, n_results=10, include=('documents', 'metadatas', 'distances')):
+        """Nearest rows by cosine distance, returned in Chroma's result layout"""
+        result = {'ids': [], 'documents': [], 'metadatas': [], 'distances': [], 'embeddings': []}
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        similarities = queries @ self.embeddings.T if self.count() else np.empty((len(queries), 0))
+
+        n_results = min(n_results, self.count())
+        for scores in similarities:
+            top = np.argpartition(-scores, n_results - 1)[:n_results] if n_results else np.empty(0, dtype=np.int64)
+            top = top[np.argsort(-scores[top])]
+            rows = [self.row(i) for i in top]
+            result['ids'].append([row[0] for row in rows])
+            result['documents'].append([row[1] for row in rows])
+            result['metadatas'].append([row[2] for row in rows])
+            result['distances'].append([float(1 - scores[i]) for i in top])
+            result['embeddings'].append(np.asarray(self.embeddings[top]))
+        for key in ('documents', 'metadatas', 'distances', 'embeddings'):
+            if key not in include:
+                result[key] = None
+        return result
+
+
+class SharedIndexStore:
+    """Builds, publishes and opens shared indexes under one root directory"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def _directory(self, name):
+        return os.path.join(self.root, name)
+
+    def _current_version(self, name):
+        try:
+            with open(os.path.join(self._directory(name), POINTER_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def open(self, name):
+        """Return the currently published index for name, or None if there is none"""
+        version = self._current_version(name)
+        if version is None:
+            with self._lock:
+                self._open.pop(name, None)
+            return None
+        with self._lock:
+            index = self._open.get(name)
+            if index is not None and os.path.basename(index.path) == version:
+                return index
+        try:
+            index = SharedIndex(os.path.join(self._directory(name), version))
+        except FileNotFoundError:
+            # Another process swapped and removed this version between reads
+            return self.open(name) if self._current_version(name) != version else None
+        with self._lock:
+            self._open[name] = index
+        return index
+
+    def build(self, name, documents, metadatas, ids, embed, source_version=0):
+        """Embed and publish rows unless the published index already holds them or newer data.
+
+        ``embed`` maps a list of documents to their embeddings. Concurrent
+        builders in other workers wait on the lock and then reuse the result.
+        """
+        fingerprint = rows_fingerprint(documents, metadatas, ids)
+        directory = self._directory(name)
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(self.root, f"{name}.lock"), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = self.open(name)
+                if current is not None and current.fingerprint == fingerprint:
+                    return current
+                if current is not None and current.source_version > source_version:
+                    logger.info(f"Keeping shared index {name}: it was built from newer data than this worker has loaded")
+                    return current
+
+                version = f"v{time.time_ns()}-{os.getpid()}"
+                path = os.path.join(directory, version)
+                self._write(path, documents, metadatas, ids, embed(documents) if documents else [], fingerprint, source_version)
+
+                # Publish by atomically replacing the pointer file
+                pointer_tmp = os.path.join(directory, f"{POINTER_FILE}.{os.getpid()}.tmp")
+                with open(pointer_tmp, 'w') as f:
+                    f.write(version)
+                os.replace(pointer_tmp, os.path.join(directory, POINTER_FILE))
+                logger.info(f"Published shared index {name}/{version} with {len(ids)} rows")
+
+                # Readers that already mapped an old version keep their pages until they close
+                self._remove_versions(directory, keep=version)
+                return self.open(name)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, path, documents, metadatas, ids, embeddings, fingerprint, source_version):
+        os.makedirs(path)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = np.zeros((len(ids), 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.save(os.path.join(path, EMBEDDINGS_FILE), matrix / np.where(norms == 0, 1, norms))
+
+        offsets = [0]
+        with open(os.path.join(path, ROWS_FILE), 'wb') as f:
+            for row in zip(ids, documents, metadatas):
+                encoded = json.dumps(row, ensure_ascii=False).encode('utf-8')
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        np.save(os.path.join(path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+        with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'source_version': source_version, 'count': len(ids),
+                       'dimensions': int(matrix.shape[1]), 'created': time.time()}, f)
+
+    def _remove_versions(self, directory, keep=None):
+        for entry in os.listdir(directory):
+            if entry != keep and entry.startswith('v'):
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    def delete(self, name):
+        """Unpublish and remove every version of an index"""
+        with self._lock:
+            self._open.pop(name, None)
+        shutil.rmtree(self._directory(name), ignore_errors=True)
@@ -0,0 +1,261 @@
+# singleflight.py
+"""Coalesce concurrent identical work into one execution.
+
+While a call for a key is in flight, later callers with the same key wait
+for it and share its result instead of repeating it. Streams are shared the
+same way: a producer runs once and every subscriber replays its items.
+
+Throttling failures (BusyError, 429/503 responses) are shared with waiters,
+since retrying would only queue the same call again on a saturated key. Other
+failures are only shared when ``share_errors`` is set; otherwise waiters run
+the work themselves, so one caller's bad API key doesn't fail everyone.
+"""
+import asyncio
+import contextvars
+import threading
+
+import metrics
+from scheduler import BusyError, is_throttling_error
+
+
+def _shares_error(flight, error):
+    """Whether waiters should get the leader's error rather than retry on their own"""
+    return flight.share_errors or isinstance(error, BusyError) or is_throttling_error(error)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-based single flight for blocking calls"""
+
+    def __init__(self, name, share_errors=False):
+        self.name = name
+        self.share_errors = share_errors
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once per in-flight key, returning its result to every concurrent caller"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.COALESCED_CALLS.inc(flight=self.name)
+            call.done.wait()
+            if call.error is None:
+                return call.result
+            if _shares_error(self, call.error):
+                raise call.error
+            return fn(*args, **kwargs)
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class _Broadcast:
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, item):
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.finished = True
+            self.error = error
+            self.condition.notify_all()
+
+    def replay(self):
+        """Yield every item published so far and as it arrives, then raise the producer's error"""
+        position = 0
+        while True:
+            with self.condition:
+                while position >= len(self.items) and not self.finished:
+                    self.condition.wait()
+                items = self.items[position:]
+                finished, error = self.finished, self.error
+            position += len(items)
+            yield from items
+            if finished and position >= len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+
+class StreamFlight:
+    """Share one run of a generator between concurrent identical streaming requests.
+
+    The producer runs on its own thread in the first caller's context, so it
+    finishes and fills in caches even if that caller disconnects.
+    """
+
+    def __init__(self, name, share_errors=False):
+        self.name = name
+        self.share_errors = share_errors
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key, gen_fn, *args, **kwargs):
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+
+        if leader:
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._produce, key, broadcast, gen_fn, args, kwargs),
+                             name=f"{self.name}-stream", daemon=True).start()
+        else:
+            metrics.COALESCED_CALLS.inc(flight=self.name)
+
+        received = 0
+        try:
+            for item in broadcast.replay():
+                received += 1
+                yield item
+        except Exception as e:
+            # Nothing was shared yet, so a waiter can still try on its own
+            if leader or received or _shares_error(self, e):
+                raise
+            yield from gen_fn(*args, **kwargs)
+
+    def _produce(self, key, broadcast, gen_fn, args, kwargs):
+        error = None
+        try:
+            for item in gen_fn(*args, **kwargs):
+                broadcast.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            broadcast.finish(error)
+
+
+class AsyncSingleFlight:
+    """Single flight for coroutines on one event loop"""
+
+    def __init__(self, name, share_errors=False):
+        self.name = name
+        self.share_errors = share_errors
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            # A task, so a cancelled caller doesn't cancel the work the others wait on
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            metrics.COALESCED_CALLS.inc(flight=self.name)
+
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if leader or _shares_error(self, e):
+                raise
+            return await coro_fn(*args, **kwargs)
+
+
+class _AsyncBroadcast:
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, item):
+        async with self.changed:
+            self.items.append(item)
+            self.changed.notify_all()
+
+    async def finish(self, error=None):
+        async with self.changed:
+            self.finished = True
+            self.error = error
+            self.changed.notify_all()
+
+    async def replay(self):
+        position = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: position < len(self.items) or self.finished)
+                items = self.items[position:]
+                finished, error = self.finished, self.error
+            position += len(items)
+            for item in items:
+                yield item
+            if finished and position >= len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+
+class AsyncStreamFlight:
+    """Async counterpart of StreamFlight; the producer runs as a task on the event loop"""
+
+    def __init__(self, name, share_errors=False):
+        self.name = name
+        self.share_errors = share_errors
+        self._streams = {}
+        self._producers = set()
+
+    async def stream(self, key, agen_fn, *args, **kwargs):
+        broadcast = self._streams.get(key)
+        leader = broadcast is None
+        if leader:
+            broadcast = self._streams[key] = _AsyncBroadcast()
+            producer = asyncio.ensure_future(self._produce(key, broadcast, agen_fn, args, kwargs))
+            # Hold a reference so the producer isn't garbage collected mid-stream
+            self._producers.add(producer)
+            producer.add_done_callback(self._producers.discard)
+        else:
+            metrics.COALESCED_CALLS.inc(flight=self.name)
+
+        received = 0
+        try:
+            async for item in broadcast.replay():
+                received += 1
+                yield item
+        except Exception as e:
+            if leader or received or _shares_error(self, e):
+                raise
+            async for item in agen_fn(*args, **kwargs):
+                yield item
+
+    async def _produce(self, key, broadcast, agen_fn, args, kwargs):
+        error = None
+        try:
+            async for item in agen_fn(*args, **kwargs):
+                await broadcast.publish(item)
+        except Exception as e:
+            error = e
+        finally:
+            self._streams.pop(key, None)
+            await broadcast.finish(error)
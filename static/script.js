@@ -220,7 +220,7 @@ strike a friendly and conversational tone. Give additional advice on top of the
                 throw new Error('Please select a university from the dropdown.');
             }
             
-            const response = await fetch('/ask', {
+            const response = await fetch('/ask/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -233,17 +233,25 @@ strike a friendly and conversational tone. Give additional advice on top of the
                 })
             });
 
-            if (!response.ok) {
+            const contentType = response.headers.get('Content-Type') || '';
+            // Busy (503) and validation replies still carry a message to show
+            if (!response.ok && !contentType.includes('application/json')) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-            
-            // Remove typing indicator
-            removeTypingIndicator(typingIndicator);
+            if (contentType.includes('text/event-stream')) {
+                // Render tokens as they arrive from the server
+                await streamBotMessage(response, typingIndicator);
+            } else {
+                // Validation errors and "still indexing" replies come back as plain JSON
+                const data = await response.json();
+                
+                // Remove typing indicator
+                removeTypingIndicator(typingIndicator);
 
-            // Display bot's answer with typing animation
-            await appendBotMessageWithTyping(data.answer);
+                // Display bot's answer with typing animation
+                await appendBotMessageWithTyping(data.answer);
+            }
 
         } catch (error) {
             console.error('Error fetching chatbot response:', error);
@@ -377,6 +385,68 @@ strike a friendly and conversational tone. Give additional advice on top of the
         await typeHTMLContent(typingContent, tempDiv);
     }
 
+    async function streamBotMessage(response, typingIndicator) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answerText = '';
+        let messageContent = null;
+
+        const render = () => {
+            if (!messageContent) {
+                removeTypingIndicator(typingIndicator);
+                const messageContainer = document.createElement('div');
+                messageContainer.className = 'max-w-4xl mx-auto animate-slide-up';
+                messageContainer.innerHTML = `
+                    <div class="text-left mb-8">
+                        <div class="text-gray-800 dark:text-gray-200 prose dark:prose-invert max-w-none"></div>
+                    </div>
+                `;
+                chatbox.appendChild(messageContainer);
+                messageContent = messageContainer.querySelector('.prose');
+            }
+            messageContent.innerHTML = marked.parse(answerText);
+            scrollToBottom();
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Server-Sent Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let eventData = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        eventName = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        eventData += line.slice(6);
+                    }
+                });
+
+                const payload = eventData ? JSON.parse(eventData) : {};
+                if (eventName === 'token' || eventName === 'sources') {
+                    answerText += payload.text;
+                    render();
+                } else if (eventName === 'error') {
+                    answerText = answerText ? `${answerText}\n\n${payload.text}` : payload.text;
+                    render();
+                }
+            }
+        }
+
+        if (!messageContent) {
+            removeTypingIndicator(typingIndicator);
+            await appendBotMessageWithTyping('Sorry, no response was received. Please try again.');
+        }
+    }
+
     async function typeHTMLContent(container, sourceElement) {
         const childNodes = Array.from(sourceElement.childNodes);
         
@@ -703,7 +773,7 @@ strike a friendly and conversational tone. Give additional advice on top of the
                 <div class="flex items-center justify-between">
                     <div>
                         <p class="text-sm font-medium text-gray-900 dark:text-white">${escapeHtml(university.name)}</p>
-                        <p class="text-xs text-gray-500 dark:text-gray-400">${university.document_count} documents</p>
+                        <p class="text-xs text-gray-500 dark:text-gray-400">${university.document_count} documents${formatUniversityStatus(university)}</p>
                     </div>
                 </div>
             `;
@@ -727,6 +797,19 @@ strike a friendly and conversational tone. Give additional advice on top of the
         }
     }
 
+    function formatUniversityStatus(university) {
+        // Readiness comes from the server's background indexer
+        if (!university.status || university.status === 'ready') {
+            return '';
+        }
+        const labels = {
+            pending: 'waiting to index',
+            indexing: 'indexing…',
+            failed: 'indexing failed'
+        };
+        return ` · ${escapeHtml(labels[university.status] || university.status)}`;
+    }
+
     function filterUniversities() {
         const searchTerm = universitySearch.value.toLowerCase();
         filteredUniversities = availableUniversities.filter(university =>
@@ -765,10 +848,8 @@ strike a friendly and conversational tone. Give additional advice on top of the
             uni.name.toLowerCase().includes(fileName.replace('.csv', '').replace(/[^a-z\s]/g, ''))
         );
         
-        if (existingUniversity) {
-            uploadStatus.classList.remove('hidden');
-            uploadMessage.textContent = `A university with similar name "${existingUniversity.name}" already exists. Please delete it first if you want to replace it.`;
-            uploadMessage.className = 'text-sm mt-2 text-red-600 dark:text-red-400';
+        // Re-uploading replaces the university in place and re-indexes only changed rows
+        if (existingUniversity && !confirm(`A university with similar name "${existingUniversity.name}" already exists. Upload this file as an update to it?`)) {
             return;
         }
         
@@ -781,6 +862,10 @@ strike a friendly and conversational tone. Give additional advice on top of the
 
         const formData = new FormData();
         formData.append('file', file);
+        const apiKey = getCurrentApiKey();
+        if (apiKey) {
+            formData.append('api_key', apiKey);
+        }
 
         try {
             // Simulate progress
@@ -815,6 +900,10 @@ strike a friendly and conversational tone. Give additional advice on top of the
                     uploadProgress.classList.add('hidden');
                 }, 2000);
                 
+                if (result.job) {
+                    trackUploadJob(result.job.id);
+                }
+                
             } else {
                 uploadMessage.textContent = result.error || 'Upload failed';
                 uploadMessage.className = 'text-sm mt-2 text-red-600 dark:text-red-400';
@@ -828,6 +917,39 @@ strike a friendly and conversational tone. Give additional advice on top of the
         }
     }
 
+    async function trackUploadJob(jobId) {
+        // Poll the indexing job for a few minutes and report how much of the file had to be embedded
+        for (let attempt = 0; attempt < 150; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            let job;
+            try {
+                const response = await fetch(`/api/jobs/${jobId}`);
+                if (!response.ok) return;
+                job = (await response.json()).job;
+            } catch (error) {
+                console.error('Job status error:', error);
+                return;
+            }
+            
+            if (job.status === 'completed') {
+                uploadMessage.textContent = `Indexing finished: ${job.embedded} rows embedded, ${job.reused} reused (${job.added} added, ${job.updated} updated, ${job.deleted} removed).`;
+                uploadMessage.className = 'text-sm mt-2 text-green-600 dark:text-green-400';
+                await loadUniversities();
+                return;
+            }
+            if (job.status === 'superseded') {
+                // A newer upload of the same university replaced this one; follow its job instead
+                return trackUploadJob(job.superseded_by);
+            }
+            if (job.status === 'failed') {
+                uploadMessage.textContent = `Indexing failed: ${job.error}`;
+                uploadMessage.className = 'text-sm mt-2 text-red-600 dark:text-red-400';
+                await loadUniversities();
+                return;
+            }
+        }
+    }
+
     function updateUniversitiesList() {
         universitiesList.innerHTML = '';
         
@@ -840,7 +962,7 @@ strike a friendly and conversational tone. Give additional advice on top of the
                     <div class="flex items-center gap-2">
                         <h4 class="text-sm font-medium text-gray-900 dark:text-white">${escapeHtml(university.name)}</h4>
                     </div>
-                    <p class="text-xs text-gray-500 dark:text-gray-400 mt-1">${university.document_count} documents</p>
+                    <p class="text-xs text-gray-500 dark:text-gray-400 mt-1">${university.document_count} documents${formatUniversityStatus(university)}</p>
                 </div>
                 <div class="flex gap-2">
                     <button class="delete-university-btn px-3 py-1 text-xs text-red-600 hover:text-red-800 dark:text-red-400 dark:hover:text-red-300 border border-red-300 dark:border-red-600 rounded hover:bg-red-50 dark:hover:bg-red-900/20 transition-colors duration-200" data-university="${escapeHtml(university.name)}">
@@ -0,0 +1,32 @@
+# tests/conftest.py
+"""Make the top-level modules and the fake Gemini client importable from tests."""
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope='session')
+def chatbot(tmp_path_factory):
+    """The app on a temporary Chroma directory with the fake Gemini client installed"""
+    work = tmp_path_factory.mktemp('chatbot')
+    saved = {name: os.environ.get(name) for name in ('CHROMA_PERSIST_DIR', 'UPLOAD_DIR')}
+    os.environ['CHROMA_PERSIST_DIR'] = str(work / 'chroma_db')
+    os.environ['UPLOAD_DIR'] = str(work / 'uploads')
+
+    fake_genai = importlib.import_module('fake_genai')
+    settings = fake_genai.install(fake_genai.FakeSettings(generate_latency=0.01))
+    app = importlib.import_module('app')
+    yield app, settings
+
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
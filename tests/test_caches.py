@@ -0,0 +1,49 @@
+# tests/test_caches.py
+"""TTL/LRU cache and the answer cache's exact, similar and invalidation lookups."""
+import time
+
+from caches import AnswerCache, TTLCache, normalize_query
+
+
+def test_normalize_query_ignores_case_spacing_and_trailing_punctuation():
+    assert normalize_query('  What is   Tuition?? ') == normalize_query('what is tuition') == 'what is tuition'
+
+
+def test_ttl_cache_evicts_least_recently_used_and_expires():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_answer_cache_matches_similar_questions_above_the_threshold():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put('Uni', 'vector:default', 'What is tuition?', 'answer', query_embedding=[1.0, 0.0])
+
+    assert cache.get('Uni', 'vector:default', 'what is TUITION') == 'answer'
+    assert cache.get('Uni', 'lexical:default', 'What is tuition?') is None
+    assert cache.get_similar('Uni', 'vector:default', [0.99, 0.05]) == 'answer'
+    assert cache.get_similar('Uni', 'vector:default', [0.0, 1.0]) is None
+    assert AnswerCache().get_similar('Uni', 'vector:default', [1.0, 0.0]) is None
+
+
+def test_invalidate_university_drops_single_and_multi_university_answers():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put('Uni', 'vector:default', 'q', 'single', query_embedding=[1.0, 0.0])
+    cache.put(('Other', 'Uni'), 'vector:default', 'q', 'federated')
+    cache.put('Other', 'vector:default', 'q', 'kept')
+
+    cache.invalidate_university('Uni')
+    assert cache.get('Uni', 'vector:default', 'q') is None
+    assert cache.get(('Other', 'Uni'), 'vector:default', 'q') is None
+    assert cache.get_similar('Uni', 'vector:default', [1.0, 0.0]) is None
+    assert cache.get('Other', 'vector:default', 'q') == 'kept'
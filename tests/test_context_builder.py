@@ -0,0 +1,53 @@
+# tests/test_context_builder.py
+"""Passage selection: adaptive depth, duplicate dropping and the token budget."""
+from context_builder import CHARS_PER_TOKEN, build_context, estimate_tokens
+
+
+def candidate(i, document, score, embedding=None):
+    return {'id': f'row-{i}', 'document': document, 'metadata': {'rec_id': str(i)}, 'score': score,
+            'embedding': embedding}
+
+
+def test_sharp_score_head_gives_a_short_context():
+    candidates = [candidate(0, 'tuition and fees for undergraduates', 1.0),
+                  candidate(1, 'housing options on campus', 0.98)]
+    candidates += [candidate(i, f'unrelated topic number {i}', 0.1 - i * 0.001) for i in range(2, 12)]
+
+    context = build_context(candidates, min_passages=2)
+    assert [passage['id'] for passage in context.passages] == ['row-0', 'row-1']
+
+
+def test_flat_scores_keep_more_passages():
+    candidates = [candidate(i, f'distinct passage about subject {i} alpha{i}', 1.0 - i * 0.01) for i in range(9)]
+    candidates.append(candidate(9, 'weak match', 0.1))
+    assert len(build_context(candidates, min_passages=2).passages) == 9
+
+
+def test_near_duplicates_are_dropped():
+    text = 'the career center helps students with resumes and interviews'
+    candidates = [candidate(0, text, 1.0), candidate(1, text + '.', 0.99), candidate(2, 'financial aid deadlines', 0.98)]
+    ids = [passage['id'] for passage in build_context(candidates).passages]
+    assert ids == ['row-0', 'row-2']
+
+    # With embeddings, similarity comes from the vectors instead of shared words
+    candidates = [candidate(0, 'a', 1.0, [1.0, 0.0]), candidate(1, 'b', 0.99, [1.0, 0.01]),
+                  candidate(2, 'c', 0.98, [0.0, 1.0])]
+    assert [passage['id'] for passage in build_context(candidates).passages] == ['row-0', 'row-2']
+
+
+def test_token_budget_limits_the_context_and_trims_only_the_first_passage():
+    candidates = [candidate(i, f'passage {i} ' + 'word ' * 40, 1.0) for i in range(10)]
+    context = build_context(candidates, token_budget=120)
+    assert context.token_count <= 120
+    assert 1 < len(context.passages) < 10
+
+    huge = candidate(0, 'x' * 10000, 1.0)
+    context = build_context([huge, candidate(1, 'short', 0.9)], token_budget=50)
+    assert len(context.passages) == 1
+    assert len(context.documents[0]) == 50 * CHARS_PER_TOKEN
+    assert estimate_tokens(context.documents[0]) <= 51
+
+
+def test_empty_documents_are_skipped():
+    context = build_context([candidate(0, '  ', 1.0), candidate(1, '', 0.9)])
+    assert context.passages == [] and context.token_count == 0
@@ -0,0 +1,55 @@
+# tests/test_embedding_cache.py
+"""On-disk embedding cache shared between worker processes."""
+import pytest
+
+from embedding_cache import EmbeddingCache, embedding_key
+
+
+def test_key_depends_on_model_task_and_content():
+    key = embedding_key('model', 'RETRIEVAL_DOCUMENT', 'text')
+    assert key == embedding_key('model', 'RETRIEVAL_DOCUMENT', 'text')
+    assert key != embedding_key('model', 'RETRIEVAL_QUERY', 'text')
+    assert key != embedding_key('other-model', 'RETRIEVAL_DOCUMENT', 'text')
+    assert key != embedding_key('model', 'RETRIEVAL_DOCUMENT', 'text ')
+
+
+def test_vectors_round_trip_and_are_visible_to_another_connection(tmp_path):
+    path = str(tmp_path / 'cache' / 'embeddings.sqlite3')
+    writer = EmbeddingCache(path)
+    writer.put_many([('a', [0.5, -1.0]), ('b', [0.25, 2.0])])
+
+    # A second worker process opens the same file
+    reader = EmbeddingCache(path)
+    found = reader.get_many(['a', 'b', 'missing', 'a'])
+    assert found == {'a': [0.5, -1.0], 'b': [0.25, 2.0]}
+
+
+def test_existing_keys_are_not_overwritten(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite3'))
+    cache.put_many([('a', [1.0])])
+    cache.put_many([('a', [2.0])])
+    cache.put_many([])
+    assert cache.get_many(['a']) == {'a': [1.0]}
+
+
+def test_lookups_larger_than_one_sqlite_batch(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite3'))
+    cache.put_many((str(i), [float(i)]) for i in range(1200))
+    found = cache.get_many([str(i) for i in range(1200)])
+    assert len(found) == 1200 and found['1199'] == pytest.approx([1199.0])
+
+
+def test_each_process_claims_its_own_chroma_directory(chatbot, tmp_path):
+    app, _ = chatbot
+    if app.fcntl is None:
+        pytest.skip("file locks are not available on this platform")
+    # flock locks belong to the open file, so claims from one process contend like separate workers
+    first = app.claim_chroma_directory(str(tmp_path))
+    second = app.claim_chroma_directory(str(tmp_path))
+    assert (first, second) == (str(tmp_path / 'worker-0'), str(tmp_path / 'worker-1'))
+
+    # A worker that exits frees its slot for the next one to start
+    lock_file = next(f for f in app.chroma_slot_locks if f.name == f'{first}.lock')
+    app.chroma_slot_locks.remove(lock_file)
+    lock_file.close()
+    assert app.claim_chroma_directory(str(tmp_path)) == first
@@ -0,0 +1,134 @@
+# tests/test_indexing.py
+"""Re-upload indexing: failed syncs and refreshes that land while a build is running."""
+import glob
+import io
+import os
+import time
+
+import pytest
+
+UNIVERSITY = 'Illinois Wesleyan'
+
+
+@pytest.fixture(scope='module')
+def rows(chatbot):
+    app, _ = chatbot
+    path = next(f for f in glob.glob(os.path.join(os.path.dirname(app.__file__), 'data', '*.csv')) if 'Wesleyan' in f)
+    frame, _ = app.read_university_csv(path)
+    return frame
+
+
+def wait_until(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def index_status(app):
+    return app.get_index_status(UNIVERSITY)['status']
+
+
+def upload(client, frame, tag):
+    edited = frame.copy()
+    edited['rec_content'] = edited['rec_content'].fillna('') + f' {tag}'
+    body = io.BytesIO(edited.to_csv(index=False).encode())
+    response = client.post('/api/universities/upload', data={'file': (body, f'{tag}.csv'), 'api_key': 'key'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['job']['id']
+
+
+def wait_for_job(client, job_id):
+    jobs = []
+    wait_until(lambda: jobs.append(client.get(f'/api/jobs/{job_id}').get_json()['job'])
+               or jobs[-1]['status'] in ('completed', 'failed'))
+    return jobs[-1]
+
+
+def rows_tagged(app, tag):
+    collection = app.chroma_client.get_collection(app.get_collection_name(UNIVERSITY))
+    return sum(tag in document for document in collection.get()['documents'])
+
+
+@pytest.fixture
+def indexed(chatbot):
+    app, _ = chatbot
+    app.schedule_indexing(UNIVERSITY, 'key')
+    wait_until(lambda: index_status(app) not in (app.INDEX_PENDING, app.INDEX_INDEXING))
+    assert index_status(app) == app.INDEX_READY
+    return app
+
+
+def test_failed_sync_fails_the_job_and_is_retried(chatbot, rows, indexed, monkeypatch):
+    app, settings = chatbot
+    client = app.app.test_client()
+
+    monkeypatch.setattr(settings, 'error_rate', 1.0)
+    job = wait_for_job(client, upload(client, rows, 'EDIT1'))
+    assert job['status'] == 'failed'
+    assert index_status(app) == app.INDEX_FAILED
+    assert rows_tagged(app, 'EDIT1') == 0
+
+    # The collection was not marked loaded, so the next build syncs the new rows
+    monkeypatch.setattr(settings, 'error_rate', 0.0)
+    app.schedule_indexing(UNIVERSITY, 'key')
+    wait_until(lambda: index_status(app) == app.INDEX_READY)
+    assert rows_tagged(app, 'EDIT1') == len(rows)
+
+
+def test_upload_during_a_build_is_synced(chatbot, rows, indexed, monkeypatch):
+    app, settings = chatbot
+    client = app.app.test_client()
+
+    monkeypatch.setattr(settings, 'embed_latency', 0.5)
+    first = upload(client, rows, 'EDIT2')
+    # Let the EDIT2 build start embedding before the next upload replaces the data
+    time.sleep(0.2)
+    second = upload(client, rows, 'EDIT3')
+
+    assert wait_for_job(client, first)['status'] == 'completed'
+    job = wait_for_job(client, second)
+    assert job['status'] == 'completed'
+    wait_until(lambda: index_status(app) == app.INDEX_READY)
+    assert rows_tagged(app, 'EDIT3') == len(rows)
+    assert job['updated'] == len(rows)
+
+
+def test_refresh_queued_behind_a_build_is_superseded_by_a_newer_one(chatbot, rows, indexed, monkeypatch):
+    app, settings = chatbot
+    client = app.app.test_client()
+
+    monkeypatch.setattr(settings, 'embed_latency', 0.5)
+    first = upload(client, rows, 'EDIT4')
+    time.sleep(0.2)
+    # Both land while the EDIT4 build runs; only the newest needs another build
+    second = upload(client, rows, 'EDIT5')
+    third = upload(client, rows, 'EDIT6')
+
+    assert wait_for_job(client, first)['status'] == 'completed'
+    replaced = client.get(f'/api/jobs/{second}').get_json()['job']
+    assert replaced['status'] == app.JOB_SUPERSEDED
+    assert replaced['superseded_by'] == third and replaced['finished_at'] is not None
+    assert wait_for_job(client, third)['status'] == 'completed'
+    wait_until(lambda: index_status(app) == app.INDEX_READY)
+    assert rows_tagged(app, 'EDIT6') == len(rows)
+
+
+def test_startup_without_a_key_only_trusts_a_collection_built_from_the_loaded_rows(chatbot, rows, indexed,
+                                                                                   monkeypatch, tmp_path):
+    app, _ = chatbot
+    monkeypatch.setattr(app, 'INDEX_API_KEY', None)
+
+    app.set_index_status(UNIVERSITY, app.INDEX_PENDING)
+    assert app.schedule_indexing(UNIVERSITY) == app.INDEX_READY
+
+    # As after redeploying with an edited CSV: the persisted collection no longer matches
+    edited = rows.copy()
+    edited['rec_content'] = edited['rec_content'].fillna('') + ' REDEPLOYED'
+    path = tmp_path / 'redeployed.csv'
+    edited.to_csv(path, index=False)
+    app.registry.add(UNIVERSITY, edited, str(path))
+    app.set_index_status(UNIVERSITY, app.INDEX_PENDING)
+    assert app.schedule_indexing(UNIVERSITY) == app.INDEX_PENDING
+    assert app.resolve_retrieval_mode(None, UNIVERSITY) == app.RETRIEVAL_LEXICAL
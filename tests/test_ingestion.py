@@ -0,0 +1,76 @@
+# tests/test_ingestion.py
+"""CSV reading: encoding fallback, chunked reads and all-string columns."""
+import pytest
+
+import ingestion
+
+HEADER = ','.join(ingestion.EXPECTED_COLUMNS)
+
+
+def write_export(path, rows, encoding='utf-8'):
+    lines = [HEADER] + [','.join(row) for row in rows]
+    path.write_bytes(('\n'.join(lines) + '\n').encode(encoding))
+    return str(path)
+
+
+def row(rec_id, content, dept_id='0'):
+    values = dict.fromkeys(ingestion.EXPECTED_COLUMNS, '')
+    values.update(rec_id=rec_id, uni_name='Test University', dept_id=dept_id, rec_url=f'https://example.edu/{rec_id}',
+                  rec_content=content)
+    return [values[column] for column in ingestion.EXPECTED_COLUMNS]
+
+
+@pytest.fixture(params=['pyarrow', 'c'])
+def engine(request, monkeypatch):
+    if request.param == 'pyarrow' and ingestion.pa_csv is None:
+        pytest.skip("pyarrow is not installed")
+    monkeypatch.setattr(ingestion, 'CSV_ENGINE', request.param)
+    return request.param
+
+
+def test_columns_are_read_as_strings(tmp_path, engine):
+    path = write_export(tmp_path / 'export.csv', [row('007', '"Line one\nline two, with a comma"'), row('8', '')])
+    df, encoding = ingestion.read_university_csv(path)
+
+    assert encoding == 'utf-8-sig'
+    assert df['rec_id'].tolist() == ['007', '8']
+    assert df['dept_id'].tolist() == ['0', '0']
+    assert df['rec_content'].iloc[0] == 'Line one\nline two, with a comma'
+    # Empty cells are missing values, not the text 'nan'
+    assert df['rec_content'].isna().tolist() == [False, True]
+    assert df['tags'].isna().all()
+
+
+def test_falls_back_to_cp1252_past_the_sampled_bytes(tmp_path, engine, monkeypatch):
+    rows = [row(str(i), 'plain text') for i in range(50)] + [row('50', 'caf\xe9 ’quoted’')]
+    path = write_export(tmp_path / 'export.csv', rows, encoding='cp1252')
+    # The sample only covers the ASCII rows, so the first guess is UTF-8
+    monkeypatch.setattr(ingestion, 'ENCODING_SAMPLE_BYTES', 256)
+    assert ingestion.detect_encoding(path, 256) == 'utf-8-sig'
+
+    df, encoding = ingestion.read_university_csv(path)
+    assert encoding == 'cp1252'
+    assert df['rec_content'].iloc[-1] == 'caf\xe9 ’quoted’'
+    assert len(df) == 51
+
+
+def test_chunked_read_matches_a_whole_file_read(tmp_path, monkeypatch):
+    path = write_export(tmp_path / 'export.csv', [row(str(i), f'content {i}', dept_id=str(i % 3)) for i in range(25)])
+    whole, _ = ingestion.read_university_csv(path)
+
+    monkeypatch.setattr(ingestion, 'CHUNKED_READ_BYTES', 0)
+    monkeypatch.setattr(ingestion, 'CSV_CHUNK_ROWS', 4)
+    chunked, _ = ingestion.read_university_csv(path)
+
+    assert chunked.fillna('').equals(whole.fillna(''))
+    assert chunked.index.tolist() == list(range(25))
+
+
+def test_build_rows_keeps_one_department(tmp_path):
+    path = write_export(tmp_path / 'export.csv', [row('1', 'general'), row('2', 'other', dept_id='5'), row('3', '')])
+    df, _ = ingestion.read_university_csv(path)
+    documents, metadatas, ids = ingestion.build_rows(df, 'Test University')
+
+    assert documents == ['general', '']
+    assert [metadata['rec_id'] for metadata in metadatas] == ['1', '3']
+    assert len(set(ids)) == 2
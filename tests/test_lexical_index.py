@@ -0,0 +1,80 @@
+# tests/test_lexical_index.py
+"""BM25 search over one university's passages and reciprocal rank fusion."""
+import math
+
+import pytest
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [
+    'Tuition and fees for undergraduate students',
+    'Graduate tuition rates and payment plans for graduate programs',
+    'Campus housing and residence halls',
+    'Career center resume reviews',
+    '',
+]
+METADATAS = [{'description': 'Bursar'}, {'description': 'Graduate school'}, {'description': 'Housing'},
+             {'description': 'Careers internships'}, None]
+IDS = ['r0', 'r1', 'r2', 'r3', 'r4']
+
+
+def reference_bm25(query, k1=1.5, b=0.75):
+    """Textbook BM25 over the same tokens, one passage at a time"""
+    docs = [tokenize(f"{document} {(metadata or {}).get('description', '')}")
+            for document, metadata in zip(DOCUMENTS, METADATAS)]
+    average = sum(map(len, docs)) / len(docs)
+    scores = []
+    for tokens in docs:
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in doc for doc in docs)
+            tf = tokens.count(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / average))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture(scope='module')
+def index():
+    return LexicalIndex(IDS, DOCUMENTS, METADATAS)
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the Tuition for 2025?") == ['tuition', '2025']
+
+
+@pytest.mark.parametrize('query', ['graduate tuition', 'housing', 'tuition fees payment', 'internships resume'])
+def test_scores_match_textbook_bm25(index, query):
+    positions, scores = index.search(query, n_results=10)
+    expected = reference_bm25(query)
+
+    assert [IDS[i] for i in positions] == [IDS[i] for i in sorted(range(len(IDS)), key=lambda i: -expected[i])
+                                           if expected[i] > 0]
+    assert list(scores) == pytest.approx([expected[i] for i in positions])
+
+
+def test_descriptions_are_searchable_and_results_are_capped(index):
+    positions, _ = index.search('internships')
+    assert [IDS[i] for i in positions] == ['r3']
+
+    positions, scores = index.search('tuition graduate housing', n_results=2)
+    assert len(positions) == 2 and scores[0] >= scores[1]
+
+
+def test_queries_without_known_terms_return_nothing(index):
+    for query in ('', 'the and of', 'astronomy'):
+        positions, scores = index.search(query)
+        assert len(positions) == 0 and len(scores) == 0
+    assert len(LexicalIndex([], [], []).search('tuition')[0]) == 0
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'a', 'd']], k=60)
+    ids = [item_id for item_id, _ in fused]
+
+    assert set(ids[:2]) == {'a', 'b'} and set(ids[2:]) == {'c', 'd'}
+    assert dict(fused)['a'] == pytest.approx(1 / 61 + 1 / 62)
+    assert [score for _, score in fused] == sorted((score for _, score in fused), reverse=True)
@@ -0,0 +1,75 @@
+# tests/test_registry.py
+"""Memory-budgeted university registry: eviction, reload and the budget metrics."""
+import glob
+import os
+
+import pytest
+
+import metrics
+from ingestion import read_university_csv
+from registry import STORED_COLUMNS, UniversityRegistry
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+
+@pytest.fixture(scope='module')
+def exports():
+    """(name, frame, path) for three shipped exports"""
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, '*.csv')))[:3]
+    return [(f'University {i}', read_university_csv(path)[0], path) for i, path in enumerate(paths)]
+
+
+def test_compact_frame_keeps_only_stored_columns(exports):
+    registry = UniversityRegistry(memory_budget_bytes=1 << 30)
+    name, frame, path = exports[0]
+    _, data, lexical_index = registry.snapshot(registry.add(name, frame, path).name)
+
+    assert list(data.columns) == STORED_COLUMNS
+    assert data['dept_id'].dtype == 'category'
+    assert lexical_index is not None and len(lexical_index) > 0
+
+
+def test_least_recently_used_university_is_evicted_and_reloaded(exports):
+    registry = UniversityRegistry(memory_budget_bytes=1 << 30)
+    for name, frame, path in exports:
+        registry.add(name, frame, path)
+    sizes = {name: registry.entry(name).nbytes for name in registry.names()}
+    first, second, third = registry.names()
+
+    # Room for the two most recently used universities only
+    registry.memory_budget_bytes = sizes[second] + sizes[third]
+    evictions, reloads = metrics.REGISTRY_EVICTIONS.value(), metrics.REGISTRY_RELOADS.value()
+    registry.snapshot(second)
+    registry.snapshot(third)
+
+    assert not registry.entry(first).resident
+    assert registry.entry(second).resident and registry.entry(third).resident
+    assert metrics.REGISTRY_EVICTIONS.value() == evictions + 1
+    assert metrics.REGISTRY_RESIDENT_BYTES.value() == sizes[second] + sizes[third]
+    # Evicted universities stay listed with their document counts
+    assert first in registry and registry.entry(first).document_count == len(exports[0][1])
+
+    entry, data, lexical_index = registry.snapshot(first)
+    assert data is not None and lexical_index is not None
+    assert metrics.REGISTRY_RELOADS.value() == reloads + 1
+    assert entry.nbytes == sizes[first]
+    # Reloading the first pushed out the least recently used of the others first
+    assert not registry.entry(second).resident
+    resident = [name for name in registry.names() if registry.entry(name).resident]
+    assert metrics.REGISTRY_RESIDENT_BYTES.value() == sum(sizes[name] for name in resident)
+
+
+def test_the_most_recently_used_university_stays_resident_over_budget(exports):
+    registry = UniversityRegistry(memory_budget_bytes=0)
+    name, frame, path = exports[0]
+    registry.add(name, frame, path)
+    assert registry.entry(name).resident
+
+    registry.remove(name)
+    assert metrics.REGISTRY_RESIDENT_BYTES.value() == 0
+
+
+def test_metrics_render_registry_counters():
+    text = metrics.render_metrics()
+    assert '# TYPE chatbot_registry_evictions_total counter' in text
+    assert '# TYPE chatbot_registry_resident_bytes gauge' in text
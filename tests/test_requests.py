@@ -0,0 +1,58 @@
+# tests/test_requests.py
+"""Malformed /ask, federated and batch payloads get a JSON 400 rather than a server error."""
+import pytest
+
+UNIVERSITY = 'Loyola University Chicago'
+
+
+@pytest.fixture
+def client(chatbot):
+    app, _ = chatbot
+    return app.app.test_client()
+
+
+def ask(client, **fields):
+    payload = {'query': 'What about tuition?', 'api_key': 'key', 'university_name': UNIVERSITY}
+    payload.update(fields)
+    return client.post('/ask', json=payload)
+
+
+def test_non_string_retrieval_mode_is_rejected(client):
+    response = ask(client, retrieval_mode=5)
+    assert response.status_code == 400
+    assert 'retrieval_mode' in response.get_json()['answer']
+
+    response = ask(client, university_name=None, university_names=[UNIVERSITY], retrieval_mode=['lexical'])
+    assert response.status_code == 400
+    assert 'retrieval_mode' in response.get_json()['answer']
+
+    response = client.post('/api/ask/batch', json={'api_key': 'key', 'retrieval_mode': 5,
+                                                   'questions': [{'university_name': UNIVERSITY, 'query': 'q'}]})
+    assert response.status_code == 400
+    assert 'retrieval_mode' in response.get_json()['error']
+
+
+def test_unknown_retrieval_mode_falls_back_to_vector(chatbot):
+    app, _ = chatbot
+    assert app.requested_retrieval_mode('LEXICAL', UNIVERSITY) == app.RETRIEVAL_LEXICAL
+    assert app.requested_retrieval_mode('semantic', UNIVERSITY) == app.RETRIEVAL_VECTOR
+
+
+def test_non_string_custom_prompt_is_rejected(client):
+    response = ask(client, custom_prompt={'text': 'Be brief'})
+    assert response.status_code == 400
+    assert 'custom_prompt' in response.get_json()['answer']
+
+    response = client.post('/ask/stream', json={'query': 'q', 'api_key': 'key', 'university_name': UNIVERSITY,
+                                                'custom_prompt': 7})
+    assert response.status_code == 400
+
+    response = ask(client, university_name=None, university_names=[UNIVERSITY], custom_prompt=7)
+    assert response.status_code == 400
+
+
+def test_prompt_variant_ignores_surrounding_whitespace(chatbot):
+    app, _ = chatbot
+    assert app.get_prompt_variant(None) == app.get_prompt_variant('   ') == f'{app.RETRIEVAL_VECTOR}:default'
+    assert app.get_prompt_variant(' Be brief ') == app.get_prompt_variant('Be brief')
+    assert app.get_prompt_variant('Be brief', app.RETRIEVAL_LEXICAL) != app.get_prompt_variant('Be brief')
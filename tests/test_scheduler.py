@@ -0,0 +1,124 @@
+# tests/test_scheduler.py
+"""Deadlines, priority order, rate limits and AIMD backoff for the Gemini scheduler."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, BusyError, Scheduler
+
+
+class Throttled(Exception):
+    code = 429
+
+
+def test_busy_error_once_the_deadline_passes():
+    sched = Scheduler({}, max_concurrency=1)
+    limiter = sched.acquire('key', 'generate')
+
+    started = time.monotonic()
+    with pytest.raises(BusyError):
+        sched.acquire('key', 'generate', timeout=0.1)
+    assert 0.1 <= time.monotonic() - started < 1
+
+    # The expired waiter left the queue, so the next caller starts as soon as the slot frees
+    assert not limiter.queue
+    sched.release(limiter)
+    sched.release(sched.acquire('key', 'generate', timeout=0.1))
+
+
+def test_busy_error_when_over_the_requests_per_minute_budget():
+    sched = Scheduler({'generate': (2, 0)})
+    for _ in range(2):
+        sched.release(sched.acquire('key', 'generate'))
+    with pytest.raises(BusyError):
+        sched.acquire('key', 'generate', timeout=0.1)
+    # Other keys have their own budget
+    sched.release(sched.acquire('other', 'generate', timeout=0.1))
+
+
+def test_interactive_calls_go_ahead_of_queued_bulk_calls():
+    sched = Scheduler({}, max_concurrency=1)
+    held = sched.acquire('key', 'generate')
+    order = []
+
+    def call(label, priority):
+        with sched.slot('key', 'generate', priority=priority, timeout=5):
+            order.append(label)
+
+    threads = []
+    for label, priority in [('bulk-1', PRIORITY_BULK), ('bulk-2', PRIORITY_BULK), ('interactive', PRIORITY_INTERACTIVE)]:
+        thread = threading.Thread(target=call, args=(label, priority))
+        thread.start()
+        threads.append(thread)
+        # Queue them in a known order
+        time.sleep(0.05)
+
+    sched.release(held)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['interactive', 'bulk-1', 'bulk-2']
+
+
+def test_throttling_halves_concurrency_and_successes_grow_it_back(monkeypatch):
+    sched = Scheduler({}, max_concurrency=8, min_concurrency=1)
+
+    def throttled_call():
+        with pytest.raises(Throttled):
+            with sched.slot('key', 'embed'):
+                raise Throttled()
+
+    throttled_call()
+    assert sched.concurrency_limit('key', 'embed') == 4
+
+    # A burst of 429s from calls already in flight counts as one signal
+    throttled_call()
+    assert sched.concurrency_limit('key', 'embed') == 4
+
+    monkeypatch.setattr(scheduler, 'BACKOFF_WINDOW_SECONDS', 0)
+    for expected in (2, 1, 1):
+        throttled_call()
+        assert sched.concurrency_limit('key', 'embed') == expected
+
+    # Additive increase: about one slot per window of successful calls, up to the maximum
+    for _ in range(3):
+        with sched.slot('key', 'embed'):
+            pass
+    assert sched.concurrency_limit('key', 'embed') == 2
+    for _ in range(100):
+        with sched.slot('key', 'embed'):
+            pass
+    assert sched.concurrency_limit('key', 'embed') == 8
+
+
+def test_other_errors_do_not_back_off():
+    sched = Scheduler({}, max_concurrency=8)
+    with pytest.raises(ValueError):
+        with sched.slot('key', 'generate'):
+            raise ValueError("bad request")
+    assert sched.concurrency_limit('key', 'generate') == 8
+
+
+def test_async_acquire_deadline_and_cancellation():
+    sched = Scheduler({}, max_concurrency=1)
+
+    async def scenario():
+        limiter = await sched.acquire_async('key', 'generate')
+        with pytest.raises(BusyError):
+            await sched.acquire_async('key', 'generate', timeout=0.1)
+
+        waiting = asyncio.ensure_future(sched.acquire_async('key', 'generate', timeout=5))
+        await asyncio.sleep(0.05)
+        assert len(limiter.queue) == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not limiter.queue
+
+        sched.release(limiter)
+        async with sched.async_slot('key', 'generate', timeout=0.1):
+            pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,101 @@
+# tests/test_shared_index.py
+"""Shared memory-mapped indexes: publishing, reuse, source versions and adoption by stale workers."""
+import os
+
+import numpy as np
+import pytest
+
+from shared_index import SharedIndexStore
+
+UNIVERSITY = 'Illinois Institute of Technology'
+
+
+class Embedder:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, documents):
+        self.calls += 1
+        return [[float(len(document)), 1.0] for document in documents]
+
+
+def rows(tag, count=3):
+    documents = [f'{tag} passage {i}' + ' x' * i for i in range(count)]
+    return documents, [{'rec_id': str(i)} for i in range(count)], [f'row-{i}' for i in range(count)]
+
+
+def test_build_publishes_and_reuses_identical_rows(tmp_path):
+    store, embed = SharedIndexStore(str(tmp_path)), Embedder()
+    index = store.build('uni', *rows('v1'), embed, source_version=1)
+    assert index.count() == 3 and index.row(0) == ('row-0', 'v1 passage 0', {'rec_id': '0'})
+
+    assert store.build('uni', *rows('v1'), embed, source_version=2).path == index.path
+    assert embed.calls == 1
+
+    result = index.query([[len('v1 passage 2 x x'), 1.0]], n_results=2)
+    assert result['ids'][0][0] == 'row-2'
+    assert result['distances'][0][0] == pytest.approx(0, abs=1e-6)
+
+
+def test_older_rows_never_replace_a_newer_index(tmp_path):
+    store, embed = SharedIndexStore(str(tmp_path)), Embedder()
+    newer = store.build('uni', *rows('new'), embed, source_version=20)
+
+    # A worker that still holds the previous upload tries to publish it
+    kept = store.build('uni', *rows('old'), embed, source_version=10)
+    assert kept.path == newer.path and kept.source_version == 20
+    assert kept.row(0)[1] == 'new passage 0'
+
+    newest = store.build('uni', *rows('newest', count=2), embed, source_version=30)
+    assert newest.source_version == 30 and newest.count() == 2
+    assert not os.path.exists(newer.path)
+
+
+def test_another_worker_sees_the_published_version(tmp_path):
+    writer, reader = SharedIndexStore(str(tmp_path)), SharedIndexStore(str(tmp_path))
+    assert reader.open('uni') is None
+
+    writer.build('uni', *rows('v1'), Embedder(), source_version=1)
+    assert reader.open('uni').source_version == 1
+    writer.build('uni', *rows('v2', count=5), Embedder(), source_version=2)
+    assert reader.open('uni').count() == 5
+
+    writer.delete('uni')
+    assert reader.open('uni') is None
+
+
+@pytest.fixture
+def shared_backend(chatbot, tmp_path, monkeypatch):
+    app, _ = chatbot
+    original = app.registry.entry(UNIVERSITY)
+    monkeypatch.setattr(app, 'VECTOR_BACKEND', app.VECTOR_BACKEND_SHARED)
+    monkeypatch.setattr(app, 'shared_indexes', SharedIndexStore(str(tmp_path / 'shared')))
+    monkeypatch.setattr(app, 'UPLOAD_DIR', str(tmp_path / 'uploads'))
+    yield app
+    df, _ = app.read_university_csv(original.source_path)
+    app.registry.add(UNIVERSITY, df, original.source_path)
+
+
+def test_stale_worker_adopts_a_newer_upload_and_reloads_its_rows(shared_backend):
+    app = shared_backend
+    app.get_or_create_shared_index('key', UNIVERSITY)
+    entry = app.registry.entry(UNIVERSITY)
+    app.store_cached_answer(UNIVERSITY, None, 'What is tuition?', app.RETRIEVAL_VECTOR, None, 'old answer', '')
+
+    # Another worker saves a smaller re-upload and publishes its index
+    df, _ = app.read_university_csv(entry.source_path)
+    os.makedirs(app.UPLOAD_DIR)
+    upload_path = os.path.join(app.UPLOAD_DIR, f"{app.get_collection_name(UNIVERSITY)}.csv")
+    df.iloc[:10].to_csv(upload_path, index=False)
+    newer = app.source_version(upload_path)
+    assert newer > entry.source_version
+    documents, metadatas, ids = app.build_rows(df.iloc[:10], UNIVERSITY)
+    app.shared_indexes.build(app.get_collection_name(UNIVERSITY), documents, metadatas, ids,
+                             lambda docs: np.ones((len(docs), 2)).tolist(), newer)
+
+    index = app.get_or_create_shared_index('key', UNIVERSITY)
+    assert index.source_version == newer and index.count() == len(ids)
+    reloaded = app.registry.entry(UNIVERSITY)
+    assert reloaded is not entry and reloaded.document_count == 10 and reloaded.collection_loaded
+    assert reloaded.source_version == newer
+    assert app.lookup_cached_answer(UNIVERSITY, None, 'What is tuition?', app.RETRIEVAL_VECTOR) is None
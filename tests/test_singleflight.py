@@ -0,0 +1,309 @@
+# tests/test_singleflight.py
+"""Coalescing and failure handling for the single-flight helpers."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import BusyError
+from singleflight import AsyncSingleFlight, AsyncStreamFlight, SingleFlight, StreamFlight
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"API error {code}")
+        self.code = code
+
+
+class Work:
+    """Counts calls and blocks the first one until released"""
+
+    def __init__(self, fail_first=False, error=None):
+        self.calls = 0
+        self.fail_first = fail_first or error is not None
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, value):
+        with self.lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            self.started.set()
+            self.release.wait(5)
+            if self.fail_first:
+                raise self.error or RuntimeError("leader failed")
+        return value * 2
+
+
+def run_concurrently(fn, count):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def let_waiters_arrive():
+    # The leader is blocked; give the other threads time to find its call and wait on it
+    time.sleep(0.1)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight, work = SingleFlight('test'), Work()
+    threads, results, errors = run_concurrently(lambda: flight.do('k', work, 21), 5)
+    assert work.started.wait(2)
+    let_waiters_arrive()
+    work.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert work.calls == 1
+    assert results == [42] * 5 and not errors
+    assert not flight._calls
+
+
+def test_single_flight_waiters_retry_when_leader_fails():
+    flight, work = SingleFlight('test'), Work(fail_first=True)
+    threads, results, errors = run_concurrently(lambda: flight.do('k', work, 21), 4)
+    assert work.started.wait(2)
+    let_waiters_arrive()
+    work.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # Only the leader sees its own failure; each waiter runs the work itself
+    assert len(errors) == 1 and str(errors[0]) == "leader failed"
+    assert results == [42] * 3
+    assert work.calls == 4
+
+
+def test_single_flight_shares_errors_when_asked():
+    flight, work = SingleFlight('test', share_errors=True), Work(fail_first=True)
+    threads, results, errors = run_concurrently(lambda: flight.do('k', work, 21), 3)
+    assert work.started.wait(2)
+    let_waiters_arrive()
+    work.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3 and not results
+    assert work.calls == 1
+
+
+@pytest.mark.parametrize('error', [BusyError("queue full"), APIError(429), APIError(503)])
+def test_single_flight_shares_throttling_errors(error):
+    flight, work = SingleFlight('test'), Work(error=error)
+    threads, results, errors = run_concurrently(lambda: flight.do('k', work, 21), 5)
+    assert work.started.wait(2)
+    let_waiters_arrive()
+    work.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # Retrying would only queue the same call again on the saturated key
+    assert errors == [error] * 5 and not results
+    assert work.calls == 1
+
+
+def test_single_flight_waiters_retry_after_a_caller_specific_api_error():
+    flight, work = SingleFlight('test'), Work(error=APIError(400))
+    threads, results, errors = run_concurrently(lambda: flight.do('k', work, 21), 3)
+    assert work.started.wait(2)
+    let_waiters_arrive()
+    work.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 1 and results == [42] * 2
+    assert work.calls == 3
+
+
+def test_stream_flight_replays_one_producer_to_every_subscriber():
+    flight = StreamFlight('test')
+    produced = []
+    gate = threading.Event()
+
+    def produce():
+        produced.append(1)
+        gate.wait(5)
+        yield from ['a', 'b', 'c']
+
+    streams = [flight.stream('k', produce) for _ in range(3)]
+    outputs = [[] for _ in streams]
+    threads = [threading.Thread(target=lambda out=out, s=s: out.extend(s)) for out, s in zip(outputs, streams)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert produced == [1]
+    assert outputs == [['a', 'b', 'c']] * 3
+
+
+def test_stream_flight_waiter_falls_back_when_producer_fails_before_any_item():
+    flight = StreamFlight('test')
+    gate = threading.Event()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        if len(calls) == 1:
+            gate.wait(5)
+            raise RuntimeError("leader failed")
+        yield 'fallback'
+
+    leader, waiter = flight.stream('k', produce), flight.stream('k', produce)
+    leader_error = []
+
+    def drain_leader():
+        try:
+            list(leader)
+        except RuntimeError as e:
+            leader_error.append(e)
+
+    # Generators register on first next(), so start the leader before the waiter
+    leader_thread = threading.Thread(target=drain_leader)
+    leader_thread.start()
+    time.sleep(0.05)
+    waiter_output = []
+    waiter_thread = threading.Thread(target=lambda: waiter_output.extend(waiter))
+    waiter_thread.start()
+    time.sleep(0.05)
+    gate.set()
+    leader_thread.join(5)
+    waiter_thread.join(5)
+
+    assert len(leader_error) == 1
+    assert waiter_output == ['fallback']
+    assert len(calls) == 2
+
+
+def test_stream_flight_shares_throttling_errors():
+    flight = StreamFlight('test')
+    gate = threading.Event()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        gate.wait(5)
+        raise APIError(429)
+        yield
+
+    streams = [flight.stream('k', produce) for _ in range(3)]
+    errors = []
+
+    def drain(stream):
+        try:
+            list(stream)
+        except APIError as e:
+            errors.append(e)
+
+    threads = []
+    for stream in streams:
+        threads.append(threading.Thread(target=drain, args=(stream,)))
+        threads[-1].start()
+        time.sleep(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert calls == [1]
+
+
+def test_async_single_flight_coalesces_and_falls_back():
+    async def scenario(fail):
+        flight = AsyncSingleFlight('test')
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            if fail and len(calls) == 1:
+                raise RuntimeError("leader failed")
+            return value * 2
+
+        results = await asyncio.gather(*(flight.do('k', work, 21) for _ in range(4)), return_exceptions=True)
+        return calls, results
+
+    calls, results = asyncio.run(scenario(fail=False))
+    assert calls == [21] and results == [42] * 4
+
+    calls, results = asyncio.run(scenario(fail=True))
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [42] * 3
+    assert len(calls) == 4
+
+
+def test_async_single_flight_shares_busy_errors():
+    async def scenario():
+        flight = AsyncSingleFlight('test')
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise BusyError("queue full")
+
+        return calls, await asyncio.gather(*(flight.do('k', work) for _ in range(4)), return_exceptions=True)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == [1]
+    assert all(isinstance(result, BusyError) for result in results)
+
+
+def test_async_stream_flight_shares_one_producer():
+    async def scenario():
+        flight = AsyncStreamFlight('test')
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            for item in 'xyz':
+                await asyncio.sleep(0.01)
+                yield item
+
+        async def collect():
+            return [item async for item in flight.stream('k', produce)]
+
+        return calls, await asyncio.gather(*(collect() for _ in range(3)))
+
+    calls, outputs = asyncio.run(scenario())
+    assert calls == [1]
+    assert outputs == [['x', 'y', 'z']] * 3
+
+
+def test_async_stream_flight_waiter_falls_back_when_producer_fails():
+    async def scenario():
+        flight = AsyncStreamFlight('test')
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            if len(calls) == 1:
+                raise RuntimeError("leader failed")
+            yield 'fallback'
+
+        async def collect():
+            return [item async for item in flight.stream('k', produce)]
+
+        return calls, await asyncio.gather(collect(), collect(), return_exceptions=True)
+
+    calls, (leader, waiter) = asyncio.run(scenario())
+    assert isinstance(leader, RuntimeError)
+    assert waiter == ['fallback']
+    assert len(calls) == 2